@@ -7,6 +7,78 @@ class Settings(BaseSettings):
     plex_app_name: str = "Movie Night"
     base_url: str = ""  # auto-detected from request if blank
 
+    # Where session data lives: "cookie" (signed cookie), "memory" or "sqlite" (server-side)
+    session_backend: str = "cookie"
+    session_store_path: str = ".cache/sessions.db"  # SQLite file for the "sqlite" backend
+    session_store_max: int = 10000  # max server-side sessions kept
+
+    # Plex connection pool
+    plex_timeout: int = 10  # seconds per Plex HTTP request
+    plex_pool_size: int = 32  # max pooled PlexServer connections
+    plex_pool_idle_ttl: int = 600  # drop connections unused for this long
+    plex_pool_health_interval: int = 60  # re-check pooled connections after this long
+
+    # Worker threads for blocking Plex calls
+    plex_max_workers: int = 16  # total threads shared by all servers
+    plex_server_concurrency: int = 4  # max in-flight calls per server
+    plex_call_timeout: int = 30  # seconds before a Plex call returns an error
+
+    # Shared HTTP clients for direct Plex requests (posters)
+    plex_http_max_connections: int = 20  # per Plex host
+
+    # Shared cache for filter choices and other Plex data
+    cache_backend: str = "memory"  # "memory" (per process) or "sqlite" (shared by workers)
+    cache_path: str = ".cache/movienight.db"  # SQLite file for the "sqlite" backend
+    cache_max_entries: int = 1024
+    filter_cache_ttl: int = 300  # seconds before filter choices are refreshed
+    filter_cache_stale_ttl: int = 86400  # how long an expired value may still be served
+    section_cache_ttl: int = 3600  # seconds before the library section list is refreshed
+
+    # Local library index used for random picks
+    library_index_refresh: int = 60  # seconds between incremental syncs with Plex
+    library_index_max: int = 16  # max indexed (server, section, user) combinations, about 1 KB per movie each
+
+    # Playlist contents cache
+    playlist_cache_max_rows: int = 50000  # total cached playlist items across all users
+
+    # Movies a user was shown recently are avoided in later draws
+    recent_history_size: int = 200  # rating keys remembered per user and server (0 disables)
+
+    # Draws computed ahead of the next "Roll the Dice"
+    prefetch_depth: int = 2  # prefetched draws per user and server (0 disables)
+
+    # Rolling across several servers at once
+    federate_servers: bool = False  # on login, roll from every server the user can access, not just the first
+    federation_timeout: float = 5  # seconds each server gets to connect and answer before it's left out
+
+    # plex.tv requests (OAuth, server discovery)
+    plex_tv_timeout: int = 10  # seconds per request
+    plex_tv_retries: int = 2  # retries on connection errors and 429/5xx
+    resources_cache_ttl: int = 300  # seconds before the user's server list is refreshed in the background
+    login_poll_wait: int = 25  # seconds a login long-poll waits before asking the browser to retry
+    pin_watch_timeout: int = 900  # give up watching an unclaimed login PIN after this long
+
+    # Connection racing for server URL selection
+    probe_timeout: float = 3  # seconds before a connection probe counts as unreachable
+    probe_ttl: int = 300  # seconds before a server's connections are re-probed in the background
+
+    # Templates and response compression
+    template_cache_dir: str = ".cache/jinja"  # compiled template bytecode (blank disables)
+    template_auto_reload: bool = True  # pick up edited templates; turn off in production
+    compress_level_gzip: int = 6
+    compress_level_br: int = 5  # used when the optional brotli package is installed
+
+    # Push-based cache invalidation
+    plex_webhook_secret: str = ""  # enables /api/plex/webhook?secret=...; blank disables it
+    plex_notifications: bool = False  # listen on each server's notifications websocket
+
+    # Resized poster cache (blank dir disables it)
+    poster_cache_dir: str = ".cache/posters"
+    poster_cache_max_bytes: int = 512 * 1024 * 1024
+
+    # Prometheus metrics at /metrics (route latency, Plex calls, cache hit rates)
+    metrics_enabled: bool = False
+
     model_config = {"env_file": ".env", "env_file_encoding": "utf-8"}
 
 
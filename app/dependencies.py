@@ -1,11 +1,15 @@
 """FastAPI dependencies for authentication."""
 
+import asyncio
 import logging
-from urllib.parse import urlparse
 
 from fastapi import HTTPException, Request
 from plexapi.server import PlexServer
-from requests import Session as RequestsSession
+
+from app.config import settings
+from app.services import federation, library_events, plex_tv, server_probe
+from app.services.plex_executor import run_plex
+from app.services.plex_pool import pool
 
 log = logging.getLogger("movienight")
 
@@ -14,7 +18,7 @@ def get_session(request: Request) -> dict:
     return request.state.session
 
 
-def require_auth(request: Request) -> PlexServer:
+async def require_auth(request: Request) -> PlexServer:
     """Return a connected PlexServer or raise 401."""
     session = request.state.session
     token = session.get("plex_token")
@@ -24,26 +28,79 @@ def require_auth(request: Request) -> PlexServer:
         log.warning("require_auth: no token/server_url in session")
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    # Cache the PlexServer instance in the session to avoid reconnecting
-    cached: PlexServer | None = session.get("_plex_server")
-    if cached is not None:
-        return cached
-
-    log.info("require_auth: connecting to %s", server_url)
     try:
-        # Plex auto-discovered URLs (*.plex.direct, raw IPs) often have certs
-        # that don't match the hostname. Only disable verification for those.
-        http_session = RequestsSession()
-        hostname = urlparse(server_url).hostname or ""
-        is_ip = hostname.replace(".", "").isdigit() or ":" in hostname
-        if hostname.endswith("plex.direct") or is_ip:
-            http_session.verify = False
-        plex = PlexServer(server_url, token, session=http_session)
+        plex = await run_plex(server_url, pool.get, server_url, token, op="connect")
     except Exception as exc:
-        # Don't clear credentials — could be a transient failure.
-        # Return a 502 so the user can retry without losing their session.
-        log.error("require_auth: Plex connection failed: %s", exc)
-        raise HTTPException(status_code=502, detail=f"Plex server unreachable: {exc}")
+        error = exc
+    else:
+        library_events.ensure_listening(plex)
+        return plex
+
+    # The active URL failed; race the server's other connections for a working one
+    server_id = session.get("server_id")
+    new_url = await server_probe.failover(server_id, server_url, token) if server_id else None
+    if new_url:
+        try:
+            plex = await run_plex(new_url, pool.get, new_url, token, op="connect")
+        except Exception as exc:
+            error = exc
+        else:
+            log.warning("require_auth: failed over from %s to %s", server_url, new_url)
+            pool.invalidate(server_url=server_url, token=token)
+            session["server_url"] = new_url
+            library_events.ensure_listening(plex)
+            return plex
+
+    # Don't clear credentials — could be a transient failure.
+    # Return a 502 so the user can retry without losing their session.
+    log.error("require_auth: Plex connection failed: %s", error)
+    raise HTTPException(status_code=502, detail=f"Plex server unreachable: {error}")
+
+
+async def require_servers(request: Request) -> list[PlexServer]:
+    """Return the session's server plus its federated servers that answer in time.
+
+    Without federated servers this is just `require_auth`. With them, every
+    server is connected concurrently and those that fail are left out; their
+    names are put in `request.state.unreachable`. Only when none answer is
+    this a 502.
+    """
+    request.state.unreachable = []
+    session = request.state.session
+    ids = session.get("federated_ids")
+    if not ids or not session.get("plex_token"):
+        return [await require_auth(request)]
+
+    token = session["plex_token"]
+    servers = [s for s in await plex_tv.get_servers(token) if s["id"] in ids and s["id"] != session.get("server_id")]
+    results = await asyncio.gather(
+        asyncio.wait_for(require_auth(request), settings.federation_timeout),
+        *(asyncio.wait_for(federation.connect(s, token), settings.federation_timeout) for s in servers),
+        return_exceptions=True,
+    )
+    names = [session.get("server_name") or "your server", *(s["name"] for s in servers)]
+    connected = []
+    for name, result in zip(names, results):
+        if isinstance(result, PlexServer):
+            connected.append(result)
+        else:
+            log.warning("require_servers: leaving out %s: %r", name, result)
+            request.state.unreachable.append(name)
+    if not connected:
+        raise HTTPException(status_code=502, detail=f"Plex servers unreachable: {', '.join(names)}")
+    return connected
 
-    session["_plex_server"] = plex
-    return plex
+
+async def require_server(request: Request, server: str = "") -> PlexServer:
+    """Return the session's server, or the federated server with machine id `server`."""
+    session = request.state.session
+    token = session.get("plex_token")
+    if not token or server not in (session.get("federated_ids") or []) or server == session.get("server_id"):
+        return await require_auth(request)
+    match = next((s for s in await plex_tv.get_servers(token) if s["id"] == server), None)
+    if match is None:
+        raise HTTPException(status_code=404, detail="Unknown server")
+    try:
+        return await asyncio.wait_for(federation.connect(match, token), settings.federation_timeout)
+    except Exception as exc:
+        raise HTTPException(status_code=502, detail=f"Plex server unreachable: {exc}") from exc
@@ -1,17 +1,42 @@
 """FastAPI application factory."""
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.exceptions import HTTPException
-from fastapi.responses import RedirectResponse, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+
+from app import metrics
+from app.config import settings
 
-from app.routers import auth, movies, pages
+from app.routers import auth, movies, pages, webhooks
+from app.services import http_clients, library_events, pin_watcher, plex_executor, poster_cache, prefetch
+from app.services.plex_executor import PlexTimeoutError
 from app.session_store import SessionMiddleware
+from app.templating import wants_json
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.poster_cache_dir:
+        await run_in_threadpool(poster_cache.cache.load)
+    yield
+    await pin_watcher.shutdown()
+    await prefetch.shutdown()
+    await library_events.shutdown()
+    await http_clients.aclose_all()
+    plex_executor.shutdown()
+
 
-app = FastAPI(title="Movie Night")
+app = FastAPI(title="Movie Night", lifespan=lifespan)
 
 # Middleware
 app.add_middleware(SessionMiddleware)
+if settings.metrics_enabled:
+    # Added last so it is outermost and times the session layer too
+    app.add_middleware(metrics.MetricsMiddleware)
 
 # Static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -20,11 +45,20 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 app.include_router(pages.router)
 app.include_router(auth.router)
 app.include_router(movies.router)
+app.include_router(webhooks.router)
+
+if settings.metrics_enabled:
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.exception_handler(401)
 async def unauthorized_handler(request: Request, exc: HTTPException):
-    """On 401, redirect to login — via HX-Redirect for HTMX requests."""
+    """On 401, redirect to login — via HX-Redirect for HTMX requests, a JSON error for API clients."""
+    if wants_json(request):
+        return JSONResponse({"detail": "Not authenticated"}, status_code=401)
     if request.headers.get("HX-Request"):
         response = Response(status_code=200)
         response.headers["HX-Redirect"] = "/"
@@ -36,6 +70,8 @@ async def unauthorized_handler(request: Request, exc: HTTPException):
 async def plex_unreachable_handler(request: Request, exc: HTTPException):
     """Plex connection failed — show retry message instead of logging out."""
     detail = getattr(exc, "detail", "Plex server unreachable")
+    if wants_json(request):
+        return JSONResponse({"detail": detail}, status_code=502)
     if request.headers.get("HX-Request"):
         return Response(
             f'<div class="text-center py-8">'
@@ -50,3 +86,9 @@ async def plex_unreachable_handler(request: Request, exc: HTTPException):
             media_type="text/html",
         )
     return Response(f"<h1>{detail}</h1><p><a href='/generate'>Retry</a></p>", status_code=502, media_type="text/html")
+
+
+@app.exception_handler(PlexTimeoutError)
+async def plex_timeout_handler(request: Request, exc: PlexTimeoutError):
+    """A Plex call ran past its deadline — same retry page as an unreachable server."""
+    return await plex_unreachable_handler(request, HTTPException(status_code=502, detail=str(exc)))
@@ -0,0 +1,175 @@
+"""In-process metrics, exported in Prometheus text format at /metrics.
+
+Three kinds of measurement:
+
+- Route latency: `MetricsMiddleware` times every request. Requests are
+  labelled by route template (`/api/poster/{rating_key}`), not raw path,
+  so the label set stays small.
+- Outbound calls: Plex library calls (via `run_plex`), poster fetches,
+  connection probes and plex.tv requests are recorded with `observe_call`,
+  tagged by operation and server.
+- Cache lookups: `cache_hit` / `cache_miss`, tagged by cache name.
+
+Recording is a dict lookup and a few additions under one lock. With
+METRICS_ENABLED off every entry point returns immediately and /metrics is
+not mounted.
+"""
+
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+
+# Seconds; covers a cached fragment (ms) up to a stalled Plex server (tens of s)
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+
+
+class _Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        # label values -> [bucket counts..., +Inf count, sum]
+        self.series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, values: tuple[str, ...], seconds: float) -> None:
+        with _lock:
+            series = self.series.get(values)
+            if series is None:
+                series = self.series[values] = [0] * (len(_BUCKETS) + 2)
+            series[bisect.bisect_left(_BUCKETS, seconds)] += 1
+            series[-1] += seconds
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            snapshot = {k: list(v) for k, v in self.series.items()}
+        for values, series in sorted(snapshot.items()):
+            labels = _labels(self.labels, values)
+            cumulative = 0
+            for bound, count in zip((*_BUCKETS, "+Inf"), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class _Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.series: defaultdict[tuple[str, ...], int] = defaultdict(int)
+
+    def inc(self, values: tuple[str, ...]) -> None:
+        with _lock:
+            self.series[values] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            snapshot = dict(self.series)
+        for values, count in sorted(snapshot.items()):
+            lines.append(f"{self.name}{{{_labels(self.labels, values)}}} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    return ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+
+
+request_duration = _Histogram(
+    "movienight_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+call_duration = _Histogram(
+    "movienight_upstream_call_duration_seconds",
+    "Outbound Plex and plex.tv call latency.",
+    ("op", "server", "outcome"),
+)
+cache_requests = _Counter("movienight_cache_requests_total", "Cache lookups by cache and result.", ("cache", "result"))
+
+_ALL = (request_duration, call_duration, cache_requests)
+
+
+def observe_call(op: str, server: str, seconds: float, outcome: str = "ok") -> None:
+    """Record one outbound call. `outcome` is "ok" or a short error class."""
+    if settings.metrics_enabled:
+        call_duration.observe((op, server, outcome), seconds)
+
+
+@contextmanager
+def timed_call(op: str, server: str):
+    """Time the enclosed outbound call; exceptions are recorded by type and re-raised."""
+    if not settings.metrics_enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as exc:
+        call_duration.observe((op, server, type(exc).__name__), time.perf_counter() - started)
+        raise
+    call_duration.observe((op, server, "ok"), time.perf_counter() - started)
+
+
+def cache_hit(name: str) -> None:
+    if settings.metrics_enabled:
+        cache_requests.inc((name, "hit"))
+
+
+def cache_miss(name: str) -> None:
+    if settings.metrics_enabled:
+        cache_requests.inc((name, "miss"))
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in _ALL:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Time each HTTP request and label it with the matched route template."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope; mounts (static) have no APIRoute
+            route = scope.get("route")
+            if route is not None:
+                path = route.path
+            elif scope["path"].startswith("/static/"):
+                path = "/static"
+            else:
+                path = "unmatched"
+            request_duration.observe((scope["method"], path, str(status)), time.perf_counter() - started)
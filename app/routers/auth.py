@@ -1,31 +1,30 @@
 """Plex OAuth login/poll/logout and server selection."""
 
+import time
 from urllib.parse import urlparse
 
-import httpx
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 
 from app.config import settings
+from app.services import pin_watcher, plex_tv, server_probe
+from app.services.http_clients import plex_tv_request
+from app.services.plex_pool import pool
+from app.services.plex_tv import PLEX_AUTH_URL, PLEX_HEADERS, PLEX_PINS_URL
 from app.session_store import clear_session
+from app.templating import templates
 
 router = APIRouter(prefix="/auth", tags=["auth"])
-templates = Jinja2Templates(directory="app/templates")
 
-PLEX_PINS_URL = "https://plex.tv/api/v2/pins"
-PLEX_AUTH_URL = "https://app.plex.tv/auth#"
-PLEX_RESOURCES_URL = "https://plex.tv/api/v2/resources"
-
-PLEX_HEADERS = {
-    "Accept": "application/json",
-    "X-Plex-Product": settings.plex_app_name,
-    "X-Plex-Client-Identifier": settings.plex_app_client_id,
-}
+# Returned while the PIN is unclaimed; its inner element immediately issues the next long-poll
+_WAITING_HTML = (
+    '<div hx-get="/auth/poll" hx-trigger="load{delay}" hx-target="#poll-status" hx-swap="innerHTML">'
+    '<p class="text-zinc-400">Waiting for Plex approval...</p></div>'
+)
 
 
 def _pick_best_url(urls: list[dict]) -> str:
-    """Pick the best connection URL: prefer remote on standard port (443), then any remote, then local."""
+    """Pick a connection URL without probing: prefer remote on standard port (443), then any remote, then local."""
     remote = [u for u in urls if u["label"] == "remote"]
     local = [u for u in urls if u["label"] == "local"]
     # Prefer remote URLs on standard HTTPS port (reverse proxy, proper cert)
@@ -50,14 +49,14 @@ def _base_url(request: Request) -> str:
 async def login(request: Request):
     """Create a Plex PIN, then redirect to Plex OAuth."""
     base = _base_url(request)
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            PLEX_PINS_URL,
-            headers=PLEX_HEADERS,
-            data={"strong": "true", "X-Plex-Product": settings.plex_app_name},
-        )
-        resp.raise_for_status()
-        pin_data = resp.json()
+    resp = await plex_tv_request(
+        "POST",
+        PLEX_PINS_URL,
+        headers=PLEX_HEADERS,
+        data={"strong": "true", "X-Plex-Product": settings.plex_app_name},
+    )
+    resp.raise_for_status()
+    pin_data = resp.json()
 
     pin_id = pin_data["id"]
     pin_code = pin_data["code"]
@@ -86,24 +85,22 @@ async def callback(request: Request):
 
 @router.get("/poll")
 async def poll(request: Request):
-    """HTMX polls this to check if PIN has been claimed."""
+    """Long-poll until the PIN is claimed.
+
+    A shared watcher polls plex.tv once per PIN; this answers as soon as the
+    token arrives, or after LOGIN_POLL_WAIT seconds so HTMX can ask again.
+    """
     session = request.state.session
     pin_id = session.get("pin_id")
     if not pin_id:
         return HTMLResponse('<p class="text-red-400">No pending login.</p>', status_code=400)
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            f"{PLEX_PINS_URL}/{pin_id}",
-            headers=PLEX_HEADERS,
-        )
-        resp.raise_for_status()
-        pin_data = resp.json()
-
-    auth_token = pin_data.get("authToken")
+    started = time.monotonic()
+    auth_token = await pin_watcher.wait_for_token(pin_id, timeout=settings.login_poll_wait)
     if not auth_token:
-        # Still waiting — HTMX will re-poll
-        return HTMLResponse('<p class="text-zinc-400">Waiting for Plex approval...</p>')
+        # Still waiting — the returned element re-polls, after a pause if the watcher gave up early
+        early = time.monotonic() - started < settings.login_poll_wait - 1
+        return HTMLResponse(_WAITING_HTML.format(delay=" delay:2s" if early else ""))
 
     # Success — store token, clean up pin
     session["plex_token"] = auth_token
@@ -123,32 +120,21 @@ async def servers(request: Request):
     if not token:
         return RedirectResponse("/", status_code=302)
 
-    headers = {**PLEX_HEADERS, "X-Plex-Token": token}
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(PLEX_RESOURCES_URL, headers=headers, params={"includeHttps": "1"})
-        resp.raise_for_status()
-        resources = resp.json()
-
-    servers = []
-    for r in resources:
-        if r.get("provides") and "server" in r["provides"]:
-            connections = r.get("connections", [])
-            urls = []
-            for c in connections:
-                uri = c.get("uri")
-                if not uri:
-                    continue
-                local = c.get("local", False)
-                urls.append({"uri": uri, "label": "local" if local else "remote"})
-            if urls:
-                servers.append({"name": r["name"], "urls": urls})
-
-    # Auto-select: prefer remote URL on standard port (443) → any remote → first local
+    servers = await plex_tv.get_servers(token)
+
+    # Auto-select: race every connection and take the fastest reachable one,
+    # falling back to remote on 443 → any remote → first local if none answer
     force_pick = request.query_params.get("pick")
     if servers and not force_pick:
-        best = _pick_best_url(servers[0]["urls"])
-        session["server_url"] = best
-        session["server_name"] = servers[0]["name"]
+        server = servers[0]
+        best = None
+        if server["id"]:
+            best = await server_probe.best_url(server["id"], [u["uri"] for u in server["urls"]], token)
+        session["server_url"] = best or _pick_best_url(server["urls"])
+        session["server_name"] = server["name"]
+        session["server_id"] = server["id"]
+        if settings.federate_servers and len(servers) > 1:
+            session["federated_ids"] = [s["id"] for s in servers[1:] if s["id"]]
         return RedirectResponse("/generate", status_code=302)
 
     # Check if current server_url is a custom one (not in discovered URLs)
@@ -163,10 +149,29 @@ async def servers(request: Request):
             "servers": servers,
             "current_url": current_url,
             "current_is_custom": current_is_custom,
+            "federated_ids": session.get("federated_ids") or [],
         },
     )
 
 
+@router.get("/probe", response_class=HTMLResponse)
+async def probe(request: Request, server_id: str = "", uri: str = ""):
+    """Probe one discovered connection and return its reachability badge."""
+    token = request.state.session.get("plex_token")
+    if not token:
+        return HTMLResponse("", status_code=401)
+    # Only probe URLs plex.tv listed for this user, never arbitrary ones
+    servers = await plex_tv.get_servers(token)
+    if not any(s["id"] == server_id and any(u["uri"] == uri for u in s["urls"]) for s in servers):
+        return HTMLResponse("", status_code=404)
+
+    latency = await server_probe.probe(uri, token)
+    server_probe.record(server_id, uri, latency)
+    if latency is None:
+        return HTMLResponse('<span class="shrink-0 text-xs text-red-400">unreachable</span>')
+    return HTMLResponse(f'<span class="shrink-0 text-xs text-green-400">{round(latency * 1000)} ms</span>')
+
+
 @router.post("/select-server")
 async def select_server(request: Request):
     form = await request.form()
@@ -181,15 +186,29 @@ async def select_server(request: Request):
             return RedirectResponse("/auth/servers?pick=1", status_code=302)
         server_url = custom_url
 
-    request.state.session["server_url"] = server_url
-    request.state.session["server_name"] = form.get("server_name", "") or urlparse(server_url).hostname or ""
-    # Clear cached PlexServer so it reconnects to the new one
-    request.state.session.pop("_plex_server", None)
+    session = request.state.session
+    old_url = session.get("server_url")
+    # Drop the pooled connection to the previous server
+    if old_url and old_url != server_url:
+        pool.invalidate(server_url=old_url, token=session.get("plex_token"))
+    session["server_url"] = server_url
+    session["server_name"] = form.get("server_name", "") or urlparse(server_url).hostname or ""
+    # Custom URLs aren't tied to a discovered server, so there's nothing to fail over to
+    session["server_id"] = "" if form.get("server_url") == "__custom__" else form.get("server_id", "")
+    # Other servers ticked to roll from alongside this one
+    federated = [i for i in form.getlist("federated_ids") if i and i != session["server_id"]]
+    if federated:
+        session["federated_ids"] = federated
+    else:
+        session.pop("federated_ids", None)
     return RedirectResponse("/generate", status_code=302)
 
 
 @router.post("/logout")
 async def logout(request: Request):
+    token = request.state.session.get("plex_token")
+    if token:
+        pool.invalidate(token=token)
     clear_session(request)
     response = RedirectResponse("/", status_code=302)
     response.delete_cookie("mn_session")
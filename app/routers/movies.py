@@ -1,64 +1,194 @@
 """Movie generation, filters, and poster proxy."""
 
+import asyncio
+
 import httpx
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import HTMLResponse, Response
-from fastapi.templating import Jinja2Templates
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from plexapi.server import PlexServer
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
 
-from app.dependencies import require_auth
-from app.services import plex_service
+from app import metrics
+from app.dependencies import require_auth, require_server, require_servers
+from app.services import federation, plex_service, poster_cache, prefetch
+from app.services.http_clients import plex_client
+from app.services.plex_executor import run_plex
+from app.templating import (
+    fragment_response,
+    json_fragment,
+    memoized_fragment,
+    memoized_json,
+    render_fragment,
+    wants_json,
+)
 
 router = APIRouter(prefix="/api", tags=["movies"])
-templates = Jinja2Templates(directory="app/templates")
 
 
 @router.get("/filters", response_class=HTMLResponse)
-async def filters(request: Request, plex: PlexServer = Depends(require_auth)):
-    data = plex_service.get_filters(plex)
-    return templates.TemplateResponse(
-        "partials/filter_form.html", {"request": request, **data}
-    )
+async def filters(request: Request, plexes: list[PlexServer] = Depends(require_servers)):
+    if request.state.session.get("federated_ids"):
+        data = await federation.get_filters(plexes)
+    else:
+        data = await run_plex(plexes[0]._baseurl, plex_service.get_filters, plexes[0])
+    if wants_json(request):
+        return fragment_response(request, memoized_json(data))
+    # Filter choices change rarely, so the rendered form is reused until they do
+    return fragment_response(request, memoized_fragment("partials/filter_form.html", data))
+
+
+def _parse_fields(fields: str) -> list[str]:
+    """Movie fields named in a comma-separated `fields` parameter (none = all)."""
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = set(names) - plex_service.MOVIE_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return names
 
 
 @router.post("/generate", response_class=HTMLResponse)
-async def generate(request: Request, plex: PlexServer = Depends(require_auth)):
+async def generate(request: Request, fields: str = "", plexes: list[PlexServer] = Depends(require_servers)):
+    """Roll movies; an HTML fragment of cards, or JSON if asked for (see templating.wants_json).
+
+    JSON clients can pass `fields=title,year,...` to receive only those movie fields.
+    """
+    names = _parse_fields(fields)
     form = await request.form()
-    movies = plex_service.get_random_movies(
-        plex,
-        count=int(form.get("count", 3)),
-        genre=form.get("genre", ""),
-        content_rating=form.get("content_rating", ""),
-        decade=form.get("decade", ""),
-        min_rating=float(form.get("min_rating", 0)),
-        playlist_key=form.get("playlist_key", ""),
-    )
-    return templates.TemplateResponse(
+    params = {
+        "count": int(form.get("count", 3)),
+        "genre": form.get("genre", ""),
+        "content_rating": form.get("content_rating", ""),
+        "decade": form.get("decade", ""),
+        "min_rating": float(form.get("min_rating", 0)),
+        "playlist_key": form.get("playlist_key", ""),
+        "section_key": form.get("section_key", ""),
+        "weighting": form.get("weighting", ""),
+    }
+    plex = plexes[0]
+    unreachable = request.state.unreachable
+    if request.state.session.get("federated_ids"):
+        # Multi-server rolls aren't prefetched; each one asks every server
+        movies, failed = await federation.get_random_movies(plexes, params)
+        unreachable = unreachable + failed
+    else:
+        movies = await prefetch.take(plex, params)
+        if movies is None:
+            movies = await run_plex(plex._baseurl, plex_service.get_random_movies, plex, **params)
+        # Draw the next roll(s) now so a re-roll is answered from memory
+        prefetch.refill(plex, params)
+    if wants_json(request):
+        data = {
+            "server_machine_id": plex.machineIdentifier,
+            "movies": [{n: m.get(n) for n in names} for m in movies] if names else movies,
+            "unreachable": unreachable,
+        }
+        return fragment_response(request, json_fragment(data))
+    fragment = render_fragment(
         "partials/movie_cards.html",
-        {"request": request, "movies": movies, "server_machine_id": plex.machineIdentifier},
+        {"movies": movies, "server_machine_id": plex.machineIdentifier, "unreachable": unreachable},
     )
+    return fragment_response(request, fragment)
+
+
+class Draw(BaseModel):
+    """One filter set in a batch roll; fields match the generate form."""
+
+    count: int = Field(3, ge=1, le=50)
+    genre: str = ""
+    content_rating: str = ""
+    decade: str = ""
+    min_rating: float = 0
+    playlist_key: str = ""
+    section_key: str = ""
+    weighting: str = ""
+
+
+class BatchRequest(BaseModel):
+    draws: list[Draw] = Field(min_length=1, max_length=20)
+    unique: bool = False  # never return the same movie twice across the batch
+
+
+@router.post("/generate/batch")
+async def generate_batch(body: BatchRequest, plex: PlexServer = Depends(require_auth)):
+    """Run several independent draws concurrently and return them together as JSON."""
+    exclude: set[int] | None = set() if body.unique else None
+    results = await asyncio.gather(
+        *(
+            run_plex(plex._baseurl, plex_service.get_random_movies, plex, exclude=exclude, **draw.model_dump())
+            for draw in body.draws
+        )
+    )
+    return {
+        "server_machine_id": plex.machineIdentifier,
+        "draws": [{"movies": movies} for movies in results],
+    }
+
+
+# Conditional request headers forwarded to Plex, and validators passed back
+_CONDITIONAL_HEADERS = ("if-none-match", "if-modified-since")
+_PASSTHROUGH_HEADERS = ("etag", "last-modified", "content-length", "content-encoding")
 
 
 @router.get("/poster/{rating_key}")
-async def poster_proxy(rating_key: str, request: Request, plex: PlexServer = Depends(require_auth)):
-    """Proxy poster images so the Plex token stays server-side."""
+async def poster_proxy(
+    rating_key: str,
+    request: Request,
+    v: str = "",
+    size: str = "",
+    plex: PlexServer = Depends(require_server),
+):
+    """Proxy poster images so the Plex token stays server-side.
+
+    With a thumb version and a size variant, serve a resized copy from the
+    on-disk poster cache; otherwise stream the original from Plex. Posters
+    from a federated server name it with `?server=<machine id>`.
+    """
+    if v and size:
+        path = await poster_cache.get_or_fetch(
+            plex._baseurl, plex._token, plex.machineIdentifier, rating_key, v, size
+        )
+        if path is not None:
+            # Versioned URL, so the browser never needs to revalidate
+            return FileResponse(
+                path,
+                media_type="image/jpeg",
+                headers={"Cache-Control": "public, max-age=31536000, immutable"},
+            )
+
     thumb_url = f"/library/metadata/{rating_key}/thumb"
     plex_url = plex._baseurl + thumb_url
     token = plex._token
 
-    async with httpx.AsyncClient(verify=False) as client:
-        resp = await client.get(
-            plex_url,
-            params={"X-Plex-Token": token},
-            follow_redirects=True,
-            timeout=10,
-        )
+    client = plex_client(plex._baseurl)
+    upstream = client.build_request(
+        "GET",
+        plex_url,
+        params={"X-Plex-Token": token},
+        headers={h: request.headers[h] for h in _CONDITIONAL_HEADERS if h in request.headers},
+    )
+    try:
+        with metrics.timed_call("GET /library/metadata/{id}/thumb", plex._baseurl):
+            resp = await client.send(upstream, stream=True, follow_redirects=True)
+    except httpx.HTTPError:
+        return Response(status_code=404)
+
+    headers = {h: resp.headers[h] for h in _PASSTHROUGH_HEADERS if h in resp.headers}
+    headers["Cache-Control"] = "public, max-age=86400"
+
+    if resp.status_code == 304:
+        await resp.aclose()
+        headers.pop("content-length", None)
+        return Response(status_code=304, headers=headers)
 
     if resp.status_code != 200:
+        await resp.aclose()
         return Response(status_code=404)
 
-    return Response(
-        content=resp.content,
+    # Stream the image straight through instead of buffering it in memory
+    return StreamingResponse(
+        resp.aiter_raw(),
         media_type=resp.headers.get("content-type", "image/jpeg"),
-        headers={"Cache-Control": "public, max-age=86400"},
+        headers=headers,
+        background=BackgroundTask(resp.aclose),
     )
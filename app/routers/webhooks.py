@@ -0,0 +1,37 @@
+"""Plex webhook receiver for cache invalidation."""
+
+import hmac
+import json
+import logging
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+from app.config import settings
+from app.services import library_events
+
+log = logging.getLogger("movienight")
+
+router = APIRouter(prefix="/api/plex", tags=["webhooks"])
+
+
+@router.post("/webhook")
+async def plex_webhook(request: Request, secret: str = ""):
+    """Receive a Plex webhook (multipart form with a JSON `payload` field).
+
+    Plex can't sign webhooks, so the URL configured in Plex carries
+    PLEX_WEBHOOK_SECRET as `?secret=`. The route is off while that's unset.
+    """
+    if not settings.plex_webhook_secret:
+        raise HTTPException(status_code=404)
+    if not hmac.compare_digest(secret, settings.plex_webhook_secret):
+        raise HTTPException(status_code=403)
+
+    form = await request.form()
+    try:
+        payload = json.loads(form.get("payload") or "{}")
+    except ValueError:
+        return Response(status_code=400)
+    if library_events.handle_webhook(payload):
+        log.info("webhook: %s from %s", payload.get("event"), payload["Server"].get("title"))
+    return Response(status_code=204)
@@ -0,0 +1,202 @@
+"""Shared cache for Plex-derived data.
+
+Two backends share one small interface:
+
+- MemoryCache: an LRU with per-entry TTLs, private to the process.
+- SQLiteCache: a WAL-mode SQLite file, so every uvicorn worker on the host
+  sees the same entries. Values must be JSON-serializable.
+
+`get_or_load` layers stale-while-revalidate on top. Once a value has been
+loaded, callers always get an answer immediately. Expired values are
+refreshed in the background.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+from app import metrics
+from app.config import settings
+
+log = logging.getLogger("movienight")
+
+
+class Cache(ABC):
+    """Key/value store where each entry remembers when it was stored."""
+
+    @abstractmethod
+    def get(self, key: str) -> tuple[float, Any] | None:
+        """Return (stored_at, value), or None if missing or past its lifetime."""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, lifetime: float) -> None:
+        """Store `value` and drop it after `lifetime` seconds."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str) -> None:
+        """Drop every key starting with `prefix`."""
+
+
+class MemoryCache(Cache):
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[float, Any] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, expires_at, value = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return stored_at, value
+
+    def set(self, key: str, value: Any, lifetime: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (now, now + lifetime, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+
+class SQLiteCache(Cache):
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, stored_at REAL, expires_at REAL, value TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, key: str) -> tuple[float, Any] | None:
+        row = self._conn().execute(
+            "SELECT stored_at, value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, value: Any, lifetime: float) -> None:
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, stored_at, expires_at, value) VALUES (?, ?, ?, ?)",
+                (key, now, now + lifetime, json.dumps(value)),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._prune(conn, now)
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM cache WHERE key NOT IN"
+            " (SELECT key FROM cache ORDER BY stored_at DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str) -> None:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache WHERE key LIKE ? ESCAPE '\\'", (escaped + "%",))
+
+
+def token_hash(token: str) -> str:
+    """Short, stable stand-in for a Plex token in cache keys (never store the token itself)."""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+def _make_cache() -> Cache:
+    if settings.cache_backend == "sqlite":
+        return SQLiteCache(Path(settings.cache_path), settings.cache_max_entries)
+    return MemoryCache(settings.cache_max_entries)
+
+
+cache = _make_cache()
+
+_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+_refreshing: set[str] = set()
+_refreshing_lock = threading.Lock()
+
+
+def get_or_load(key: str, loader: Callable[[], Any], *, ttl: float, stale_ttl: float) -> Any:
+    """Return the cached value for `key`, calling `loader` only on a cold miss.
+
+    A value older than `ttl` is still returned for up to `stale_ttl` more
+    seconds, while one background call to `loader` replaces it.
+    """
+    name = key.split(":", 1)[0]
+    hit = cache.get(key)
+    if hit is None:
+        metrics.cache_miss(name)
+        value = loader()
+        cache.set(key, value, ttl + stale_ttl)
+        return value
+
+    metrics.cache_hit(name)
+    stored_at, value = hit
+    if time.time() - stored_at >= ttl:
+        _refresh_in_background(key, loader, ttl + stale_ttl)
+    return value
+
+
+def _refresh_in_background(key: str, loader: Callable[[], Any], lifetime: float) -> None:
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            cache.set(key, loader(), lifetime)
+        except Exception as exc:
+            # Keep serving the stale value; the next read retries
+            log.warning("cache: background refresh of %s failed: %s", key, exc)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    _refresher.submit(refresh)
@@ -0,0 +1,146 @@
+"""Rolls across several Plex servers at once.
+
+Besides its main server, a session can list extra servers to roll from
+(`federated_ids`, chosen on the server picker). Every server is connected
+and drawn from concurrently. Each one gets FEDERATION_TIMEOUT seconds, so a
+slow server costs at most that long, and a server that is down just drops
+out of the result instead of failing the roll.
+
+Each server draws `count` movies from its own candidates. `merge` then
+combines those samples into one draw over all the servers' candidates, so
+a small library isn't shown as often as a large one just because it's on
+its own server.
+"""
+
+import asyncio
+import logging
+import random
+
+from plexapi.server import PlexServer
+
+from app.config import settings
+from app.services import library_events, plex_service, server_probe
+from app.services.plex_executor import run_plex
+from app.services.plex_pool import pool
+
+log = logging.getLogger("movienight")
+
+# Library and playlist keys only mean something on their own server, so in
+# federated filters they're sent as "<machine id>/<key>"
+_KEY_SEP = "/"
+
+
+async def connect(server: dict, token: str) -> PlexServer:
+    """Connect to a discovered server ({"name", "id", "urls"}) on its fastest URL."""
+    uris = [u["uri"] for u in server["urls"]]
+    url = await server_probe.best_url(server["id"], uris, token)
+    if url is None:
+        raise ConnectionError(f"no reachable connection for {server['name']}")
+    try:
+        plex = await run_plex(url, pool.get, url, token, op="connect", timeout=settings.federation_timeout)
+    except Exception:
+        url = await server_probe.failover(server["id"], url, token)
+        if url is None:
+            raise
+        plex = await run_plex(url, pool.get, url, token, op="connect", timeout=settings.federation_timeout)
+    library_events.ensure_listening(plex)
+    return plex
+
+
+async def _each(plexes: list[PlexServer], fn, **kwargs) -> tuple[list[tuple[PlexServer, object]], list[str]]:
+    """Run a plex_service function on every server; return (server, result) pairs and the names that failed."""
+    results = await asyncio.gather(
+        *(run_plex(p._baseurl, fn, p, timeout=settings.federation_timeout, **kwargs) for p in plexes),
+        return_exceptions=True,
+    )
+    answered, failed = [], []
+    for plex, result in zip(plexes, results):
+        if isinstance(result, Exception):
+            log.warning("federation: %s left out of %s: %s", plex.friendlyName, fn.__name__, result)
+            failed.append(plex.friendlyName)
+        else:
+            answered.append((plex, result))
+    if not answered:
+        raise next(r for r in results if isinstance(r, Exception))
+    return answered, failed
+
+
+async def get_filters(plexes: list[PlexServer]) -> dict:
+    """Union of the servers' filter choices; libraries and playlists are labelled by server."""
+    answered, _ = await _each(plexes, plex_service.get_filters)
+    genres: set[str] = set()
+    content_ratings: set[str] = set()
+    decades: set[str] = set()
+    playlists, libraries = [], []
+    for plex, data in answered:
+        genres.update(data["genres"])
+        content_ratings.update(data["content_ratings"])
+        decades.update(data["decades"])
+        prefix = plex.machineIdentifier + _KEY_SEP
+        suffix = f" ({plex.friendlyName})"
+        playlists += [{"title": p["title"] + suffix, "ratingKey": prefix + str(p["ratingKey"])} for p in data["playlists"]]
+        libraries += [{"key": prefix + s["key"], "title": s["title"] + suffix} for s in data["libraries"]]
+    return {
+        "genres": sorted(genres),
+        "content_ratings": sorted(content_ratings),
+        "decades": sorted(decades),
+        "playlists": playlists,
+        "libraries": libraries,
+    }
+
+
+async def get_random_movies(plexes: list[PlexServer], params: dict) -> tuple[list[dict], list[str]]:
+    """Draw from every server and merge; return the movies and the names of servers left out.
+
+    Each movie carries the `server_id` (machine id) it came from.
+    """
+    params = dict(params)
+    for name in ("playlist_key", "section_key"):
+        machine_id, sep, key = params[name].partition(_KEY_SEP)
+        if sep:
+            # A playlist or library lives on one server, so only that one is asked
+            plexes = [p for p in plexes if p.machineIdentifier == machine_id]
+            params[name] = key
+    if not plexes:
+        return [], []
+
+    answered, failed = await _each(plexes, plex_service.draw_movies, **params)
+    for plex, (movies, _, _) in answered:
+        for m in movies:
+            m["server_id"] = plex.machineIdentifier
+    movies = merge([result for _, result in answered], params["count"])
+    for plex, _ in answered:
+        plex_service.remember(plex, [m for m in movies if m["server_id"] == plex.machineIdentifier])
+    return movies, failed
+
+
+def merge(draws: list[tuple[list[dict], int, float]], count: int) -> list[dict]:
+    """Combine per-server draws into one draw of `count` from all their candidates.
+
+    `draws` holds each server's random picks (in draw order), the number of
+    candidates they came from, and those candidates' total weight. Repeatedly choosing a server in
+    proportion to its remaining weight and taking its next pick samples the
+    union as if it were one library, without shipping candidate lists
+    around. For uniform draws this is exact. For weighted ones each pick
+    removes the server's average weight, which is close enough. A movie found
+    on two servers is only shown once.
+    """
+    pools = [[list(movies), weight, weight / size] for movies, size, weight in draws if movies and weight > 0]
+    chosen: list[dict] = []
+    seen: set[tuple[str, int | None]] = set()
+    while len(chosen) < count and pools:
+        x = random.random() * sum(p[1] for p in pools)
+        for entry in pools:
+            x -= entry[1]
+            if x < 0:
+                break
+        movies, _, step = entry
+        movie = movies.pop(0)
+        entry[1] = max(entry[1] - step, 0.0)
+        if not movies or not entry[1]:
+            pools.remove(entry)
+        key = (movie["title"].casefold(), movie["year"])
+        if key not in seen:
+            seen.add(key)
+            chosen.append(movie)
+    return chosen
@@ -0,0 +1,66 @@
+"""Recently shown movies per user, so back-to-back rolls don't repeat.
+
+Each login on each server keeps a fixed-size ring buffer of the last
+RECENT_HISTORY_SIZE rating keys it was shown, plus a set for O(1) lookups.
+Draws avoid those keys while the filters leave anything else to pick.
+"""
+
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from plexapi.server import PlexServer
+
+from app.config import settings
+from app.services.cache import token_hash
+
+_MAX_USERS = 4096
+
+
+class RecentHistory:
+    """The last `size` distinct rating keys added, oldest dropped first."""
+
+    def __init__(self, size: int):
+        self._ring = array("L", [0]) * size  # 0 = empty slot; Plex rating keys start at 1
+        self._pos = 0
+        self._keys: set[int] = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, keys: Iterable[int]) -> None:
+        with self._lock:
+            for key in keys:
+                if key in self._keys:
+                    continue
+                oldest = self._ring[self._pos]
+                if oldest:
+                    self._keys.discard(oldest)
+                self._ring[self._pos] = key
+                self._keys.add(key)
+                self._pos = (self._pos + 1) % len(self._ring)
+
+
+_histories: OrderedDict[str, RecentHistory] = OrderedDict()
+_lock = threading.Lock()
+
+
+def history_for(plex: PlexServer) -> RecentHistory | None:
+    """Return this login's history on this server, or None if history is disabled."""
+    if settings.recent_history_size <= 0:
+        return None
+    key = f"{plex.machineIdentifier}:{token_hash(plex._token)}"
+    with _lock:
+        history = _histories.get(key)
+        if history is None:
+            history = _histories[key] = RecentHistory(settings.recent_history_size)
+            while len(_histories) > _MAX_USERS:
+                _histories.popitem(last=False)
+        else:
+            _histories.move_to_end(key)
+    return history
@@ -0,0 +1,113 @@
+"""App-lifetime httpx clients, one per upstream host.
+
+Reusing a client keeps its connections (and TLS sessions) alive between
+requests, instead of paying a fresh handshake for every poster or every
+login poll.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import urlparse
+
+import httpx
+
+from app import metrics
+from app.config import settings
+from app.services.plex_pool import plex_op, skip_tls_verify
+
+log = logging.getLogger("movienight")
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+# Worth retrying: plex.tv is briefly overloaded or restarting
+_RETRY_STATUSES = {429, 502, 503, 504}
+
+
+def _origin(url: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def plex_client(base_url: str) -> httpx.AsyncClient:
+    """Return the shared client for the Plex server at `base_url`."""
+    origin = _origin(base_url)
+    client = _clients.get(origin)
+    if client is None or client.is_closed:
+        client = _clients[origin] = httpx.AsyncClient(
+            http2=True,
+            verify=not skip_tls_verify(base_url),
+            timeout=settings.plex_timeout,
+            limits=httpx.Limits(
+                max_connections=settings.plex_http_max_connections,
+                max_keepalive_connections=settings.plex_http_max_connections,
+                keepalive_expiry=60,
+            ),
+        )
+    return client
+
+
+def probe_client(verify: bool) -> httpx.AsyncClient:
+    """Return the client shared by all connection probes.
+
+    Probes hit every candidate URL of every user's servers, so they don't
+    get a client per origin. Connections aren't kept alive either: each
+    probe then pays (and measures) a full connect, and nothing is left open
+    for origins that are never used again.
+    """
+    key = "probe" if verify else "probe-insecure"
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        client = _clients[key] = httpx.AsyncClient(
+            verify=verify,
+            timeout=settings.probe_timeout,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=0),
+        )
+    return client
+
+
+def plex_tv_client() -> httpx.AsyncClient:
+    """Return the shared client for plex.tv (OAuth PINs, resources)."""
+    client = _clients.get("plex.tv")
+    if client is None or client.is_closed:
+        client = _clients["plex.tv"] = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.plex_tv_timeout, connect=5),
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=120),
+                retries=1,  # reconnect once on a failed connect before our own backoff
+            ),
+        )
+    return client
+
+
+async def plex_tv_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Send a request to plex.tv, retrying transient failures with jittered backoff."""
+    client = plex_tv_client()
+    op = plex_op(method, urlparse(url).path)
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ReadTimeout, httpx.RemoteProtocolError) as exc:
+            metrics.observe_call(op, "plex.tv", time.perf_counter() - started, type(exc).__name__)
+            if attempt >= settings.plex_tv_retries:
+                raise
+            log.warning("plex.tv %s %s failed (%s), retrying", method, url, exc)
+        else:
+            outcome = "ok" if resp.is_success else str(resp.status_code)
+            metrics.observe_call(op, "plex.tv", time.perf_counter() - started, outcome)
+            if resp.status_code not in _RETRY_STATUSES or attempt >= settings.plex_tv_retries:
+                return resp
+            log.warning("plex.tv %s %s returned %s, retrying", method, url, resp.status_code)
+        await asyncio.sleep(0.5 * 2**attempt * random.uniform(0.5, 1.5))
+        attempt += 1
+
+
+async def aclose_all() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -0,0 +1,165 @@
+"""React to library changes pushed by Plex instead of waiting for TTLs.
+
+Two sources feed `library_changed`:
+
+- Plex webhooks, POSTed by the server to /api/plex/webhook (a Plex Pass
+  feature, configured under Settings > Webhooks).
+- Optionally, PLEX_NOTIFICATIONS: one websocket per connected server on
+  `/:/websockets/notifications`, which reports item and playlist changes
+  for every server, Plex Pass or not.
+
+A change drops the server's cached filter choices and section list for all
+users. It marks the affected library indexes for an incremental sync and
+discards prefetched draws. Other workers pick the change up through the
+shared cache backend, the next time they use an index or a prefetched draw. Changes are debounced: a library scan produces a
+burst of events but only one invalidation.
+"""
+
+import asyncio
+import json
+import logging
+import ssl
+from urllib.parse import urlencode
+
+from plexapi.server import PlexServer
+
+from app.config import settings
+from app.services import cache, library_index, prefetch
+from app.services.plex_pool import skip_tls_verify
+
+try:
+    import websockets
+except ImportError:  # installed with uvicorn[standard]
+    websockets = None
+
+log = logging.getLogger("movienight")
+
+_DEBOUNCE = 2.0  # seconds of quiet before a burst of changes is applied
+
+# Pending invalidations: machine id -> (timer, sections touched or None for all, filters touched)
+_pending: dict[str, tuple[asyncio.TimerHandle, set[str] | None, bool]] = {}
+
+
+def library_changed(machine_id: str, section_key: str | None = None, *, filters: bool = True) -> None:
+    """Schedule invalidation of a server's caches after the current burst of changes.
+
+    `filters=False` is for changes that can't affect the filter choices
+    (watch state), which only need the library indexes re-synced.
+    """
+    loop = asyncio.get_running_loop()
+    timer, sections, pending_filters = _pending.get(machine_id, (None, set(), False))
+    if timer is not None:
+        timer.cancel()
+    if sections is not None:
+        sections = None if section_key is None else sections | {section_key}
+    filters = filters or pending_filters
+    timer = loop.call_later(_DEBOUNCE, _apply, machine_id, sections, filters)
+    _pending[machine_id] = (timer, sections, filters)
+
+
+def _apply(machine_id: str, sections: set[str] | None, filters: bool) -> None:
+    _pending.pop(machine_id, None)
+    if filters:
+        cache.cache.delete_prefix(f"filters:{machine_id}:")
+        cache.cache.delete_prefix(f"sections:{machine_id}:")
+    if sections is None:
+        library_index.mark_stale(machine_id)
+    else:
+        for section_key in sections:
+            library_index.mark_stale(machine_id, section_key)
+    prefetch.invalidate(machine_id)
+    log.info("library_events: invalidated caches for %s (sections: %s)", machine_id, sections or "all")
+
+
+# Webhook events that change what a draw can return
+_LIBRARY_EVENTS = {"library.new"}
+_WATCH_EVENTS = {"media.scrobble"}  # changes view counts, not filter choices
+
+
+def handle_webhook(payload: dict) -> bool:
+    """Apply a Plex webhook payload; return True if it invalidated anything."""
+    event = payload.get("event", "")
+    machine_id = (payload.get("Server") or {}).get("uuid")
+    if not machine_id or event not in _LIBRARY_EVENTS | _WATCH_EVENTS:
+        return False
+    section = (payload.get("Metadata") or {}).get("librarySectionID")
+    library_changed(machine_id, str(section) if section else None, filters=event in _LIBRARY_EVENTS)
+    return True
+
+
+# Timeline entry states and types from the notifications stream
+_STATE_DONE = 5
+_STATE_DELETED = 9
+_TYPE_MOVIE = 1
+_TYPE_PLAYLIST = 15
+
+
+def handle_notification(machine_id: str, message: dict) -> None:
+    container = message.get("NotificationContainer") or {}
+    if container.get("type") != "timeline":
+        return
+    for entry in container.get("TimelineEntry", []):
+        if entry.get("state") not in (_STATE_DONE, _STATE_DELETED):
+            continue
+        if entry.get("type") == _TYPE_MOVIE:
+            section = entry.get("sectionID")
+            library_changed(machine_id, str(section) if section not in (None, -1, "-1") else None)
+        elif entry.get("type") == _TYPE_PLAYLIST:
+            # Only the playlist list in the filters is cached; contents revalidate on use
+            library_changed(machine_id)
+
+
+_listeners: dict[str, asyncio.Task] = {}
+
+
+def ensure_listening(plex: PlexServer) -> None:
+    """Start the notifications listener for this server if it isn't running yet."""
+    if not settings.plex_notifications or websockets is None:
+        return
+    machine_id = plex.machineIdentifier
+    task = _listeners.get(machine_id)
+    if task is None or task.done():
+        _listeners[machine_id] = asyncio.create_task(_listen(machine_id, plex._baseurl, plex._token))
+
+
+async def _listen(machine_id: str, base_url: str, token: str) -> None:
+    url = base_url.replace("http", "ws", 1) + "/:/websockets/notifications?" + urlencode({"X-Plex-Token": token})
+    ssl_context = None
+    if url.startswith("wss:") and skip_tls_verify(base_url):
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    failures = 0
+    reconnecting = False
+    while failures < 5:
+        try:
+            async with websockets.connect(url, ssl=ssl_context, open_timeout=settings.plex_timeout) as ws:
+                log.info("library_events: listening for notifications from %s", machine_id)
+                failures = 0
+                if reconnecting:
+                    # Anything may have changed while we weren't listening
+                    library_changed(machine_id)
+                reconnecting = True
+                async for raw in ws:
+                    try:
+                        handle_notification(machine_id, json.loads(raw))
+                    except (ValueError, AttributeError) as exc:
+                        log.debug("library_events: bad notification from %s: %s", machine_id, exc)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            failures += 1
+            log.warning("library_events: notifications from %s dropped (%s), retry %d", machine_id, exc, failures)
+        await asyncio.sleep(min(2**failures, 60))
+    # Give up for now; the next request to this server starts a fresh listener
+    log.warning("library_events: stopped listening to %s", machine_id)
+
+
+async def shutdown() -> None:
+    for task in _listeners.values():
+        task.cancel()
+    _listeners.clear()
+    for timer, _, _ in _pending.values():
+        timer.cancel()
+    _pending.clear()
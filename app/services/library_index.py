@@ -0,0 +1,452 @@
+"""In-process columnar index of a movie library section.
+
+Each index is built from one bulk `/library/sections/<key>/all` fetch. It
+then stays current with `updatedAt`-filtered queries, plus `lastViewedAt`
+ones for watch state, so a roll is answered locally instead of with a Plex
+search per click. Rows are stored column by
+column in compact `array`s. Filters (genre, content rating, decade, minimum
+score) are Python ints used as bitsets over row numbers, so combining them
+is a handful of big-int ANDs rather than a loop over movies.
+
+Sampling works on memoized candidate lists: the rows matching a filter set
+and, for weighted draws, their cumulative weights. Each pick is then one
+random number plus a bisect, so a roll costs O(k log n) for k movies.
+Excluded and recently shown movies are skipped by rejection. Only when most
+candidates are skipped does a roll fall back to scanning the list.
+"""
+
+import logging
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Container
+from itertools import accumulate
+from urllib.parse import urlencode
+from xml.etree.ElementTree import Element
+
+from plexapi.server import PlexServer
+
+from app.config import settings
+from app.services import cache
+from app.services.cache import token_hash
+
+log = logging.getLogger("movienight")
+
+_PAGE_SIZE = 1000  # rows per request when building an index
+_MEMO_MAX = 64  # memoized candidate lists per table
+
+# Ways to bias a draw (the filter form's "Favor" choices); anything else draws uniformly
+WEIGHTINGS = ("rating", "unwatched", "recent")
+_UNRATED = 5.0  # audience rating assumed for unrated movies
+_UNWATCHED_BOOST = 4.0
+_RECENT_HALF_LIFE = 180 * 86400  # seconds of addedAt age that halve a movie's weight
+
+# A table's rows and cumulative weights (None = uniform) for one filter set
+Segment = tuple["MovieTable", list[int], list[float] | None]
+
+# Guards exclusion sets shared by concurrent draws
+_exclude_lock = threading.Lock()
+
+# Row offsets of the set bits in each byte value, for decoding bitsets
+_BYTE_BITS = [tuple(i for i in range(8) if b >> i & 1) for b in range(256)]
+
+
+def thumb_version(thumb: str | None) -> str:
+    """Plex thumb paths end in a timestamp that changes with the artwork:
+    /library/metadata/<key>/thumb/<version>."""
+    if not thumb:
+        return ""
+    version = thumb.rsplit("/", 1)[-1]
+    return version if version.isdigit() else ""
+
+
+def bits_to_rows(mask: int) -> list[int]:
+    """Return the positions of the set bits in `mask`, in ascending order."""
+    rows: list[int] = []
+    for offset, byte in enumerate(mask.to_bytes((mask.bit_length() + 7) // 8, "little")):
+        if byte:
+            base = offset * 8
+            rows.extend(base + i for i in _BYTE_BITS[byte])
+    return rows
+
+
+class MovieTable:
+    """Columnar movie rows with bitset indexes for filtering and sampling."""
+
+    def __init__(self):
+        self.rating_keys = array("L")
+        self.years = array("H")  # 0 = unknown
+        self.audience_ratings = array("f")  # 0.0 = unrated
+        self.durations = array("L")  # milliseconds
+        self.added_at = array("L")
+        self.updated_at = array("L")
+        self.view_counts = array("L")
+        self.last_viewed_at = array("L")  # 0 = never
+        self.titles: list[str] = []
+        self.summaries: list[str] = []
+        self.content_ratings: list[str] = []
+        self.thumb_versions: list[str] = []
+        self.row_genres: list[tuple[str, ...]] = []
+
+        self.live = 0  # rows that currently exist
+        self.with_thumb = 0  # rows that have a poster
+        self.by_genre: dict[str, int] = {}
+        self.by_content_rating: dict[str, int] = {}
+        self.by_decade: dict[int, int] = {}
+        self._rows: dict[int, int] = {}  # rating key -> row
+        self._rating_masks: dict[float, int] = {}  # memoized min-score bitsets
+        self._segments: dict[tuple, Segment] = {}  # memoized candidates per (filters, weighting)
+        self._memo_lock = threading.Lock()
+
+    @classmethod
+    def from_videos(cls, videos) -> "MovieTable":
+        """Build a table from `<Video>` elements, skipping anything that isn't a movie."""
+        table = cls()
+        for video in videos:
+            if video.get("type") == "movie":
+                table.upsert(video)
+        return table
+
+    def __len__(self) -> int:
+        return self.live.bit_count()
+
+    def upsert(self, video: Element) -> None:
+        """Insert or replace the row for a `<Video type="movie">` element."""
+        rating_key = int(video.get("ratingKey"))
+        row = self._rows.get(rating_key)
+        if row is None:
+            row = self._rows[rating_key] = len(self.rating_keys)
+            self.rating_keys.append(rating_key)
+            for col in (self.years, self.durations, self.added_at, self.updated_at, self.view_counts,
+                        self.last_viewed_at):
+                col.append(0)
+            self.audience_ratings.append(0.0)
+            for col in (self.titles, self.summaries, self.content_ratings, self.thumb_versions):
+                col.append("")
+            self.row_genres.append(())
+        else:
+            self._unindex(row)
+
+        year = int(video.get("year") or 0)
+        thumb = video.get("thumb")
+        self.years[row] = year
+        self.audience_ratings[row] = float(video.get("audienceRating") or 0)
+        self.durations[row] = int(video.get("duration") or 0)
+        self.added_at[row] = int(video.get("addedAt") or 0)
+        self.updated_at[row] = int(video.get("updatedAt") or 0)
+        self.view_counts[row] = int(video.get("viewCount") or 0)
+        self.last_viewed_at[row] = int(video.get("lastViewedAt") or 0)
+        self.titles[row] = video.get("title") or ""
+        self.summaries[row] = video.get("summary") or ""
+        self.content_ratings[row] = video.get("contentRating") or ""
+        self.thumb_versions[row] = thumb_version(thumb)
+        self.row_genres[row] = tuple(g.get("tag") for g in video.iter("Genre"))
+
+        bit = 1 << row
+        self.live |= bit
+        if thumb:
+            self.with_thumb |= bit
+        for genre in self.row_genres[row]:
+            self.by_genre[genre] = self.by_genre.get(genre, 0) | bit
+        rating = self.content_ratings[row]
+        if rating:
+            self.by_content_rating[rating] = self.by_content_rating.get(rating, 0) | bit
+        if year:
+            decade = year - year % 10
+            self.by_decade[decade] = self.by_decade.get(decade, 0) | bit
+        self._forget_memos()
+
+    def watched_count(self) -> int:
+        views = self.view_counts
+        return sum(1 for row in self._rows.values() if views[row])
+
+    def mark_unwatched_except(self, watched: set[int]) -> None:
+        """Reset the view count of every movie whose rating key isn't in `watched`."""
+        views = self.view_counts
+        for rating_key, row in self._rows.items():
+            if views[row] and rating_key not in watched:
+                views[row] = 0
+                self.last_viewed_at[row] = 0
+        self._forget_memos()
+
+    def remove(self, rating_key: int) -> None:
+        row = self._rows.pop(rating_key, None)
+        if row is not None:
+            self._unindex(row)
+
+    def _unindex(self, row: int) -> None:
+        keep = ~(1 << row)
+        self.live &= keep
+        self.with_thumb &= keep
+        for index in (self.by_genre, self.by_content_rating, self.by_decade):
+            for value in list(index):
+                index[value] &= keep
+        self._forget_memos()
+
+    def _forget_memos(self) -> None:
+        # Replaced, not mutated, so draws holding an old segment stay consistent
+        self._rating_masks = {}
+        self._segments = {}
+
+    def filter(self, genre: str = "", content_rating: str = "", decade: str = "", min_rating: float = 0) -> int:
+        """Return the bitset of live rows matching every given filter."""
+        mask = self.live
+        if genre:
+            mask &= self.by_genre.get(genre, 0)
+        if content_rating:
+            mask &= self.by_content_rating.get(content_rating, 0)
+        if decade:
+            mask &= self.by_decade.get(int(decade), 0)
+        if min_rating:
+            mask &= self._rating_mask(min_rating)
+        return mask
+
+    def _rating_mask(self, min_rating: float) -> int:
+        mask = self._rating_masks.get(min_rating)
+        if mask is None:
+            mask = 0
+            for row, rating in enumerate(self.audience_ratings):
+                if rating >= min_rating:
+                    mask |= 1 << row
+            self._rating_masks[min_rating] = mask
+        return mask
+
+    def segment(self, weighting: str = "", **filters) -> Segment:
+        """Return the rows matching `filters` and their cumulative weights, memoized."""
+        weighting = weighting if weighting in WEIGHTINGS else ""
+        key = (weighting, *sorted(filters.items()))
+        segments = self._segments
+        segment = segments.get(key)
+        if segment is None:
+            rows = bits_to_rows(self.filter(**filters))
+            cum = list(accumulate(self._weights(rows, weighting))) if weighting and rows else None
+            segment = (self, rows, cum)
+            with self._memo_lock:
+                while len(segments) >= _MEMO_MAX:
+                    segments.pop(next(iter(segments)))
+                segments[key] = segment
+        return segment
+
+    def _weights(self, rows: list[int], weighting: str) -> list[float]:
+        if weighting == "rating":
+            ratings = self.audience_ratings
+            return [(ratings[r] or _UNRATED) ** 2 for r in rows]
+        if weighting == "unwatched":
+            views = self.view_counts
+            return [1.0 if views[r] else _UNWATCHED_BOOST for r in rows]
+        # "recent": relative to the newest candidate, so weights don't drift with the clock
+        added = self.added_at
+        newest = max(added[r] for r in rows)
+        return [0.5 ** ((newest - added[r]) / _RECENT_HALF_LIFE) + 0.01 for r in rows]
+
+    def row_dict(self, row: int) -> dict:
+        """Return a row as a movie dict, with the keys in plex_service.MOVIE_FIELDS."""
+        duration = self.durations[row]
+        return {
+            "title": self.titles[row],
+            "year": self.years[row] or None,
+            "rating_key": self.rating_keys[row],
+            "summary": self.summaries[row],
+            "audience_rating": round(self.audience_ratings[row], 1) or None,
+            "content_rating": self.content_ratings[row],
+            "duration_minutes": round(duration / 60000) if duration else None,
+            "genres": list(self.row_genres[row]),
+            "has_thumb": bool(self.with_thumb >> row & 1),
+            "thumb_version": self.thumb_versions[row],
+        }
+
+
+class LibraryIndex:
+    """A MovieTable for one section, kept in sync with Plex."""
+
+    def __init__(self, section_key: str):
+        self.section_key = section_key
+        self.table = MovieTable()
+        self.synced_at = 0.0  # monotonic time of the last sync
+        self.synced_wall = 0.0  # the same as wall-clock time, to compare with other workers' invalidations
+        self.stale = False  # set by change notifications to force a sync on next use
+        self.max_updated_at = 0
+        self.max_viewed_at = 0
+        self.lock = threading.Lock()
+
+    def sync(self, plex: PlexServer) -> None:
+        """Build the table on first use, then apply only rows changed since the last sync."""
+        path = f"/library/sections/{self.section_key}/all"
+        started = time.monotonic()
+        started_wall = time.time()
+        if not self.synced_at:
+            table = MovieTable()
+            start = 0
+            while True:
+                container = plex.query(f"{path}?{urlencode({'type': 1, 'X-Plex-Container-Start': start, 'X-Plex-Container-Size': _PAGE_SIZE})}")
+                for video in container.iter("Video"):
+                    if video.get("type") == "movie":
+                        table.upsert(video)
+                start += _PAGE_SIZE
+                if start >= int(container.get("totalSize") or container.get("size") or 0):
+                    break
+            self.table = table
+            log.info("library_index: built section %s with %d movies", self.section_key, len(table))
+        else:
+            # Plex's `>>=` is strictly greater; step back a second so same-second edits aren't missed
+            changed = plex.query(f"{path}?type=1&updatedAt>>={self.max_updated_at - 1}")
+            for video in changed.iter("Video"):
+                if video.get("type") == "movie":
+                    self.table.upsert(video)
+            self._sync_view_state(plex, path)
+            total = plex.query(f"{path}?{urlencode({'type': 1, 'X-Plex-Container-Start': 0, 'X-Plex-Container-Size': 0})}")
+            if int(total.get("totalSize") or 0) != len(self.table):
+                # Something was deleted; deletions don't show up as updates
+                self.synced_at = 0.0
+                self.sync(plex)
+                return
+        self.max_updated_at = max(self.table.updated_at, default=0)
+        self.max_viewed_at = max(self.table.last_viewed_at, default=0)
+        self.synced_at = started
+        self.synced_wall = started_wall
+        self.stale = False
+
+    def _sync_view_state(self, plex: PlexServer, path: str) -> None:
+        """Apply watch-state changes, which don't touch `updatedAt`.
+
+        Newly watched movies have a newer `lastViewedAt`. Movies marked
+        unwatched leave no trace, so when Plex counts fewer watched movies
+        than the table does, the watched set is re-read.
+        """
+        viewed = plex.query(f"{path}?type=1&lastViewedAt>>={self.max_viewed_at - 1}")
+        for video in viewed.iter("Video"):
+            if video.get("type") == "movie":
+                self.table.upsert(video)
+        params = {"type": 1, "unwatched": 0, "X-Plex-Container-Start": 0, "X-Plex-Container-Size": 0}
+        watched = plex.query(f"{path}?{urlencode(params)}")
+        if int(watched.get("totalSize") or 0) < self.table.watched_count():
+            keys = {int(v.get("ratingKey")) for v in plex.query(f"{path}?type=1&unwatched=0").iter("Video")}
+            self.table.mark_unwatched_except(keys)
+
+
+def draw(
+    segments: list[Segment],
+    count: int,
+    exclude: set[int] | None = None,
+    recent: Container[int] | None = None,
+) -> list[tuple["MovieTable", int]]:
+    """Pick up to `count` distinct (table, row) pairs across segments, by weight.
+
+    Skips rating keys in `exclude` (adding the picks to it) and avoids keys in
+    `recent`, repeating a recent movie only when the filters leave no other.
+    """
+    segments = [s for s in segments if s[1]]
+    if not segments or count <= 0:
+        return []
+    if exclude is None:
+        return _draw(segments, count, set(), recent)
+    with _exclude_lock:
+        chosen = _draw(segments, count, exclude, recent)
+        exclude.update(table.rating_keys[row] for table, row in chosen)
+    return chosen
+
+
+def _draw(
+    segments: list[Segment], count: int, exclude: Container[int], recent: Container[int] | None
+) -> list[tuple["MovieTable", int]]:
+    bounds = list(accumulate(cum[-1] if cum else len(rows) for _, rows, cum in segments))
+    total = bounds[-1]
+    chosen: list[tuple[MovieTable, int]] = []
+    seen: set[tuple[int, int]] = set()
+
+    def allowed(table: MovieTable, row: int, allow_recent: bool) -> bool:
+        key = table.rating_keys[row]
+        return key not in exclude and (allow_recent or recent is None or key not in recent)
+
+    # Rejection sampling: expected O(count) draws while most candidates are allowed
+    for _ in range(count * 8 + 16):
+        if len(chosen) == count:
+            return chosen
+        x = random.random() * total
+        s = min(bisect_right(bounds, x), len(segments) - 1)
+        table, rows, cum = segments[s]
+        offset = x - (bounds[s - 1] if s else 0)
+        i = min(bisect_right(cum, offset) if cum else int(offset), len(rows) - 1)
+        if (s, rows[i]) not in seen and allowed(table, rows[i], False):
+            seen.add((s, rows[i]))
+            chosen.append((table, rows[i]))
+
+    # Most candidates are excluded or recent: take the rest uniformly, then recent repeats
+    for allow_recent in (False, True):
+        if len(chosen) == count:
+            break
+        rest = [
+            (s, table, row)
+            for s, (table, rows, _) in enumerate(segments)
+            for row in rows
+            if (s, row) not in seen and allowed(table, row, allow_recent)
+        ]
+        for s, table, row in random.sample(rest, min(count - len(chosen), len(rest))):
+            seen.add((s, row))
+            chosen.append((table, row))
+    return chosen
+
+
+def segments_across(indexes: list["LibraryIndex"], weighting: str = "", **filters) -> list[Segment]:
+    """Return each index's candidate segment for `filters`, ready for `draw`."""
+    segments = []
+    for index in indexes:
+        with index.lock:
+            segments.append(index.table.segment(weighting, **filters))
+    return segments
+
+
+def size(segments: list[Segment]) -> tuple[int, float]:
+    """Number of candidates in `segments` and their combined weight (the same for uniform draws)."""
+    count = sum(len(rows) for _, rows, _ in segments)
+    return count, sum(cum[-1] if cum else len(rows) for _, rows, cum in segments if rows)
+
+
+# (machine id, section key, token hash) -> index. Per token, because shared
+# users may be restricted to part of a library and watch state is per user.
+_indexes: OrderedDict[tuple[str, str, str], LibraryIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(plex: PlexServer, section_key: str) -> LibraryIndex:
+    """Return the synced index for a section, as seen by this connection's token."""
+    key = (plex.machineIdentifier, str(section_key), token_hash(plex._token))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = LibraryIndex(str(section_key))
+        _indexes.move_to_end(key)
+        while len(_indexes) > settings.library_index_max:
+            _indexes.popitem(last=False)
+
+    with index.lock:
+        if (
+            index.stale
+            or time.monotonic() - index.synced_at >= settings.library_index_refresh
+            or _invalidated_at(key[0], key[1]) > index.synced_wall
+        ):
+            index.sync(plex)
+    return index
+
+
+def mark_stale(machine_id: str, section_key: str | None = None) -> None:
+    """Make the next pick from this server's indexes (or one section's) sync first.
+
+    Indexes in this process are flagged directly. Other workers see the
+    change time in the shared cache and sync the next time they use an
+    index built before it.
+    """
+    cache.cache.set(f"index-stale:{machine_id}:{section_key or '*'}", time.time(), settings.library_index_refresh)
+    with _indexes_lock:
+        for (machine, section, _), index in _indexes.items():
+            if machine == machine_id and section_key in (None, section):
+                index.stale = True
+
+
+def _invalidated_at(machine_id: str, section_key: str) -> float:
+    """Wall time of the latest change reported for this section by any worker (0 if none)."""
+    times = [hit[1] for k in ("*", section_key) if (hit := cache.cache.get(f"index-stale:{machine_id}:{k}"))]
+    return max(times, default=0.0)
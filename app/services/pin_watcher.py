@@ -0,0 +1,82 @@
+"""Server-side watcher for pending Plex login PINs.
+
+Each pending PIN gets one background task that polls plex.tv with backoff,
+however many browser tabs are waiting on it. Browsers long-poll
+`wait_for_token` and are answered the moment the token arrives, instead of
+each running their own poll loop against plex.tv.
+"""
+
+import asyncio
+import logging
+
+from app.config import settings
+from app.services.http_clients import plex_tv_request
+from app.services.plex_tv import PLEX_HEADERS, PLEX_PINS_URL
+
+log = logging.getLogger("movienight")
+
+_FIRST_DELAY = 1.0
+_MAX_DELAY = 5.0
+_IDLE_LIMIT = 60  # stop polling a PIN nobody has waited on for this long
+_KEEP_RESULT = 60  # keep finished watches this long so late pollers see the result
+
+
+class _Watch:
+    def __init__(self, pin_id: int):
+        self.pin_id = pin_id
+        self.last_waited = asyncio.get_running_loop().time()
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> str | None:
+        loop = asyncio.get_running_loop()
+        delay = _FIRST_DELAY
+        deadline = loop.time() + settings.pin_watch_timeout
+        try:
+            while loop.time() < deadline and loop.time() - self.last_waited < _IDLE_LIMIT:
+                resp = await plex_tv_request("GET", f"{PLEX_PINS_URL}/{self.pin_id}", headers=PLEX_HEADERS)
+                if resp.status_code == 404:
+                    return None  # expired or unknown PIN
+                resp.raise_for_status()
+                token = resp.json().get("authToken")
+                if token:
+                    return token
+                await asyncio.sleep(delay)
+                delay = min(delay * 1.5, _MAX_DELAY)
+            return None
+        finally:
+            loop.call_later(_KEEP_RESULT, _forget, self)
+
+
+_watches: dict[int, _Watch] = {}
+
+
+def _forget(watch: _Watch) -> None:
+    if _watches.get(watch.pin_id) is watch:
+        del _watches[watch.pin_id]
+
+
+async def wait_for_token(pin_id: int, timeout: float) -> str | None:
+    """Wait up to `timeout` seconds for the PIN to be claimed; return its auth token.
+
+    Returns None if the PIN isn't claimed yet (or expired, or plex.tv failed),
+    in which case the caller should simply ask again.
+    """
+    watch = _watches.get(pin_id)
+    if watch is None or (watch.task.done() and watch.task.exception() is not None):
+        watch = _watches[pin_id] = _Watch(pin_id)
+    watch.last_waited = asyncio.get_running_loop().time()
+
+    done, _ = await asyncio.wait({watch.task}, timeout=timeout)
+    watch.last_waited = asyncio.get_running_loop().time()
+    if not done:
+        return None
+    if watch.task.exception() is not None:
+        log.warning("pin_watcher: polling PIN %s failed: %s", pin_id, watch.task.exception())
+        return None
+    return watch.task.result()
+
+
+async def shutdown() -> None:
+    for watch in list(_watches.values()):
+        watch.task.cancel()
+    _watches.clear()
@@ -0,0 +1,72 @@
+"""Cache of playlist contents, revalidated against the playlist's metadata.
+
+Re-rolling a playlist used to download every item again. Now the contents
+are kept as a MovieTable, and each roll only fetches `/playlists/<key>`,
+a single small element. The table is reused while that element's
+`updatedAt` and `leafCount` are unchanged. Entries are per user, because
+playlists belong to the user. Total cached rows across everyone are capped,
+and the least recently used playlists are dropped first.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from plexapi.exceptions import NotFound
+from plexapi.server import PlexServer
+
+from app import metrics
+from app.config import settings
+from app.services.cache import token_hash
+from app.services.library_index import MovieTable
+
+log = logging.getLogger("movienight")
+
+
+@dataclass
+class _Entry:
+    stamp: tuple[str | None, str | None]  # (updatedAt, leafCount)
+    table: MovieTable
+
+
+_entries: OrderedDict[tuple[str, str, str], _Entry] = OrderedDict()
+_total_rows = 0
+_lock = threading.Lock()
+
+
+def get_table(plex: PlexServer, rating_key: str) -> MovieTable:
+    """Return the contents of a video playlist, refetching only if it changed."""
+    global _total_rows
+    if not str(rating_key).isdigit():
+        return MovieTable()
+    try:
+        playlist = plex.query(f"/playlists/{rating_key}").find("Playlist")
+    except NotFound:
+        return MovieTable()
+    if playlist is None or playlist.get("playlistType") != "video":
+        return MovieTable()
+
+    key = (plex.machineIdentifier, token_hash(plex._token), str(rating_key))
+    stamp = (playlist.get("updatedAt"), playlist.get("leafCount"))
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry.stamp == stamp:
+            _entries.move_to_end(key)
+            metrics.cache_hit("playlists")
+            return entry.table
+
+    metrics.cache_miss("playlists")
+    log.info("playlist_cache: fetching playlist %s", rating_key)
+    table = MovieTable.from_videos(plex.query(f"/playlists/{rating_key}/items").iter("Video"))
+
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            _total_rows -= len(old.table.rating_keys)
+        _entries[key] = _Entry(stamp, table)
+        _total_rows += len(table.rating_keys)
+        while _total_rows > settings.playlist_cache_max_rows and len(_entries) > 1:
+            _, evicted = _entries.popitem(last=False)
+            _total_rows -= len(evicted.table.rating_keys)
+    return table
@@ -0,0 +1,100 @@
+"""Run blocking plexapi calls off the event loop.
+
+Every Plex library call goes through `run_plex`, which runs it on a bounded
+thread pool. Each server gets its own concurrency limit, so a stalled server
+can tie up at most `plex_server_concurrency` workers and the rest keep
+serving other users. The slot is held until the worker thread actually
+finishes, even if the caller timed out or disconnected, so abandoned calls
+still count against their server's limit.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from app import metrics
+from app.config import settings
+
+log = logging.getLogger("movienight")
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=settings.plex_max_workers, thread_name_prefix="plex")
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+class PlexTimeoutError(Exception):
+    """A Plex call did not finish within its deadline."""
+
+
+def _semaphore(server_key: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(server_key)
+    if sem is None:
+        sem = _semaphores[server_key] = asyncio.Semaphore(settings.plex_server_concurrency)
+    return sem
+
+
+async def run_plex(
+    server_key: str,
+    fn: Callable[..., T],
+    *args: Any,
+    timeout: float | None = None,
+    op: str | None = None,
+    **kwargs: Any,
+) -> T:
+    """Run `fn(*args, **kwargs)` on the Plex pool, limited per `server_key`.
+
+    Raises PlexTimeoutError if the call (including time spent waiting for a
+    slot) takes longer than `timeout` seconds. `op` names the call in
+    metrics (default: the function's name).
+    """
+    op = op or getattr(fn, "__name__", "call")
+    started = time.perf_counter()
+    try:
+        result = await _run(server_key, fn, args, kwargs, timeout)
+    except BaseException as exc:
+        outcome = "timeout" if isinstance(exc, PlexTimeoutError) else type(exc).__name__
+        metrics.observe_call(op, server_key, time.perf_counter() - started, outcome)
+        raise
+    metrics.observe_call(op, server_key, time.perf_counter() - started)
+    return result
+
+
+async def _run(server_key: str, fn: Callable[..., T], args: tuple, kwargs: dict, timeout: float | None) -> T:
+    timeout = settings.plex_call_timeout if timeout is None else timeout
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    sem = _semaphore(server_key)
+
+    try:
+        await asyncio.wait_for(sem.acquire(), timeout)
+    except asyncio.TimeoutError:
+        raise PlexTimeoutError(f"Plex server busy: {server_key}") from None
+
+    try:
+        cfut = _executor.submit(functools.partial(fn, *args, **kwargs))
+    except BaseException:
+        sem.release()
+        raise
+    cfut.add_done_callback(lambda _: loop.call_soon_threadsafe(sem.release))
+    afut = asyncio.wrap_future(cfut, loop=loop)
+    # Consume the result of abandoned calls so asyncio doesn't log it
+    afut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(afut), max(deadline - loop.time(), 0))
+    except asyncio.TimeoutError:
+        cfut.cancel()  # only succeeds if the call hasn't started yet
+        log.warning("run_plex: %s timed out after %ss on %s", getattr(fn, "__name__", fn), timeout, server_key)
+        raise PlexTimeoutError(f"Plex server timed out: {server_key}") from None
+    except asyncio.CancelledError:
+        # Client went away — drop the call if it's still queued
+        cfut.cancel()
+        raise
+
+
+def shutdown() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,155 @@
+"""Process-wide pool of connected PlexServer instances.
+
+Connecting a PlexServer costs a `GET /` round trip plus a fresh
+`requests.Session`, so connections are shared across requests, keyed by
+(server_url, token). Entries are evicted when idle or when the pool is full,
+and re-checked with a cheap `/identity` call before reuse once they go stale.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+from plexapi.server import PlexServer
+from requests import Session as RequestsSession
+
+from app import metrics
+from app.config import settings
+
+log = logging.getLogger("movienight")
+
+PoolKey = tuple[str, str]  # (server_url, token)
+
+
+@dataclass
+class _Entry:
+    plex: PlexServer
+    last_used: float
+    last_checked: float
+
+
+def skip_tls_verify(url: str) -> bool:
+    """Plex auto-discovered URLs (*.plex.direct, raw IPs) often have certs
+    that don't match the hostname. Only disable verification for those."""
+    hostname = urlparse(url).hostname or ""
+    is_ip = hostname.replace(".", "").isdigit() or ":" in hostname
+    return hostname.endswith("plex.direct") or is_ip
+
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def plex_op(method: str, path: str) -> str:
+    """Metric label for a Plex request: "GET /library/sections/{id}/all"."""
+    return f"{method} {_ID_SEGMENT.sub('/{id}', path.split('?', 1)[0])}"
+
+
+def _record_response(resp, *args, **kwargs) -> None:
+    # requests response hook; `elapsed` runs until the headers arrived
+    req = resp.request
+    metrics.observe_call(
+        plex_op(req.method, req.path_url),
+        resp.url.split(req.path_url, 1)[0],
+        resp.elapsed.total_seconds(),
+        "ok" if resp.ok else str(resp.status_code),
+    )
+
+
+def _connect(server_url: str, token: str) -> PlexServer:
+    http_session = RequestsSession()
+    if skip_tls_verify(server_url):
+        http_session.verify = False
+    if settings.metrics_enabled:
+        http_session.hooks["response"].append(_record_response)
+    return PlexServer(server_url, token, session=http_session, timeout=settings.plex_timeout)
+
+
+def _is_healthy(plex: PlexServer) -> bool:
+    try:
+        plex.query("/identity")
+    except Exception as exc:
+        log.warning("plex_pool: health check failed for %s: %s", plex._baseurl, exc)
+        return False
+    return True
+
+
+class PlexPool:
+    """LRU pool of PlexServer connections with idle eviction and health checks."""
+
+    def __init__(self, max_size: int, idle_ttl: float, health_interval: float):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.health_interval = health_interval
+        self._entries: OrderedDict[PoolKey, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, server_url: str, token: str) -> PlexServer:
+        """Return a pooled connection, connecting (and raising) on a miss."""
+        key = (server_url, token)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.last_used = now
+
+        if entry is not None:
+            if now - entry.last_checked < self.health_interval:
+                return entry.plex
+            if _is_healthy(entry.plex):
+                entry.last_checked = time.monotonic()
+                return entry.plex
+            self._discard(key, entry)
+
+        log.info("plex_pool: connecting to %s", server_url)
+        plex = _connect(server_url, token)
+        now = time.monotonic()
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                # Another request connected while we were; keep the first one
+                return existing.plex
+            self._entries[key] = _Entry(plex, now, now)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return plex
+
+    def invalidate(self, server_url: str | None = None, token: str | None = None) -> None:
+        """Drop every connection matching the given server URL and/or token."""
+        with self._lock:
+            for key in list(self._entries):
+                url, tok = key
+                if (server_url is None or url == server_url) and (token is None or tok == token):
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _discard(self, key: PoolKey, entry: _Entry) -> None:
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def _evict_idle(self, now: float) -> None:
+        # Entries are in LRU order, so stop at the first one still in use
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.last_used < self.idle_ttl:
+                break
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+pool = PlexPool(
+    max_size=settings.plex_pool_size,
+    idle_ttl=settings.plex_pool_idle_ttl,
+    health_interval=settings.plex_pool_health_interval,
+)
@@ -1,41 +1,71 @@
 """All Plex library interactions."""
 
-import random
-import time
-
+from plexapi.exceptions import NotFound
 from plexapi.server import PlexServer
-from plexapi.video import Movie
 
-_filter_cache: dict[str, tuple[float, dict]] = {}  # keyed by server URL
-FILTER_CACHE_TTL = 300  # 5 minutes
+from app.config import settings
+from app.services import cache, history, library_index, playlist_cache
+
+
+def user_cache_key(kind: str, plex: PlexServer) -> str:
+    """Cache key scoped to one server and one user's token.
+
+    Playlists (and library access for shared users) differ per token.
+    """
+    return f"{kind}:{plex.machineIdentifier}:{cache.token_hash(plex._token)}"
+
+
+def get_movie_sections(plex: PlexServer) -> list[dict]:
+    """Return the server's movie libraries as [{"key", "title"}] (cached per server and user)."""
+    return cache.get_or_load(
+        user_cache_key("sections", plex),
+        lambda: _load_movie_sections(plex),
+        ttl=settings.section_cache_ttl,
+        stale_ttl=settings.filter_cache_stale_ttl,
+    )
 
 
-def get_movie_library(plex: PlexServer):
-    """Return the first movie library section."""
-    for section in plex.library.sections():
-        if section.type == "movie":
-            return section
-    return None
+def _load_movie_sections(plex: PlexServer) -> list[dict]:
+    return [
+        {"key": d.get("key"), "title": d.get("title")}
+        for d in plex.query("/library/sections").iter("Directory")
+        if d.get("type") == "movie"
+    ]
+
+
+def invalidate_sections(plex: PlexServer) -> None:
+    """Forget cached section data for this server and user, e.g. after a library was removed."""
+    cache.cache.delete(user_cache_key("sections", plex))
+    cache.cache.delete(user_cache_key("filters", plex))
 
 
 def get_filters(plex: PlexServer) -> dict:
-    """Return available filter values for the UI (cached 5 min per server)."""
-    cache_key = plex._baseurl
-    now = time.monotonic()
-    cached = _filter_cache.get(cache_key)
-    if cached and (now - cached[0]) < FILTER_CACHE_TTL:
-        return cached[1]
+    """Return available filter values for the UI.
+
+    Served from the shared cache; once loaded, stale values are returned
+    immediately and refreshed in the background.
+    """
+    return cache.get_or_load(
+        user_cache_key("filters", plex),
+        lambda: _load_filters(plex),
+        ttl=settings.filter_cache_ttl,
+        stale_ttl=settings.filter_cache_stale_ttl,
+    )
 
-    lib = get_movie_library(plex)
-    if not lib:
-        return {"genres": [], "content_ratings": [], "decades": [], "playlists": []}
 
-    genres = sorted(g.title for g in lib.listFilterChoices("genre"))
-    content_ratings = sorted(r.title for r in lib.listFilterChoices("contentRating"))
+def _load_filters(plex: PlexServer) -> dict:
+    sections = _load_movie_sections(plex)
+    # Refresh the section list alongside the filters it was derived from
+    cache.cache.set(user_cache_key("sections", plex), sections, settings.section_cache_ttl + settings.filter_cache_stale_ttl)
 
-    # Build decade list from the library's year range
-    years = lib.listFilterChoices("decade")
-    decades = sorted(y.title for y in years)
+    # Union the choices of every movie library
+    genres: set[str] = set()
+    content_ratings: set[str] = set()
+    decades: set[str] = set()
+    for section in sections:
+        genres.update(_filter_choices(plex, section["key"], "genre"))
+        content_ratings.update(_filter_choices(plex, section["key"], "contentRating"))
+        decades.update(_filter_choices(plex, section["key"], "decade"))
 
     # Playlists
     playlists = []
@@ -43,14 +73,17 @@ def get_filters(plex: PlexServer) -> dict:
         if pl.playlistType == "video":
             playlists.append({"title": pl.title, "ratingKey": pl.ratingKey})
 
-    result = {
-        "genres": genres,
-        "content_ratings": content_ratings,
-        "decades": decades,
+    return {
+        "genres": sorted(genres),
+        "content_ratings": sorted(content_ratings),
+        "decades": sorted(decades),
         "playlists": playlists,
+        "libraries": sections,
     }
-    _filter_cache[cache_key] = (now, result)
-    return result
+
+
+def _filter_choices(plex: PlexServer, section_key: str, field: str) -> list[str]:
+    return [d.get("title") for d in plex.query(f"/library/sections/{section_key}/{field}").iter("Directory")]
 
 
 def get_random_movies(
@@ -62,85 +95,96 @@ def get_random_movies(
     decade: str = "",
     min_rating: float = 0,
     playlist_key: str = "",
+    section_key: str = "",
+    weighting: str = "",
+    exclude: set[int] | None = None,
 ) -> list[dict]:
-    """Pick random movies matching filters."""
-    if playlist_key:
-        # Playlists can't use server-side search, fall back to client-side
-        movies = _get_playlist_movies(plex, playlist_key)
-        filtered = _apply_filters(movies, genre, content_rating, decade, min_rating)
-        count = min(count, len(filtered))
-        if count == 0:
-            return []
-        chosen = random.sample(filtered, count)
-        return [_movie_to_dict(m) for m in chosen]
-
-    lib = get_movie_library(plex)
-    if not lib:
-        return []
-
-    # Build server-side filters for Plex to handle
-    kwargs: dict = {}
-    filters: dict = {}
-    if genre:
-        kwargs["genre"] = genre
-    if content_rating:
-        kwargs["contentRating"] = content_rating
-    if decade:
-        kwargs["decade"] = int(decade)
-    if min_rating:
-        filters["audienceRating>>"] = min_rating
-
-    # Let Plex pick random results server-side — avoids fetching the whole library
-    # Request extra to account for possible non-Movie items, then trim
-    results = lib.search(
-        sort="random",
-        maxresults=count * 2,
-        filters=filters if filters else None,
-        **kwargs,
+    """Pick random movies matching filters.
+
+    Library picks come from every movie library, or just `section_key` if given.
+    `weighting` biases the draw (see library_index.WEIGHTINGS). Movies this
+    user was shown recently are avoided while anything else matches. Movies
+    whose rating key is in `exclude` are skipped, and picks are added to it.
+    """
+    movies, _, _ = draw_movies(
+        plex,
+        count=count,
+        genre=genre,
+        content_rating=content_rating,
+        decade=decade,
+        min_rating=min_rating,
+        playlist_key=playlist_key,
+        section_key=section_key,
+        weighting=weighting,
+        exclude=exclude,
     )
-
-    chosen = [m for m in results if isinstance(m, Movie)][:count]
-    return [_movie_to_dict(m) for m in chosen]
-
-
-def _apply_filters(
-    movies: list, genre: str, content_rating: str, decade: str, min_rating: float
-) -> list[Movie]:
-    """Client-side filtering for playlist movies."""
-    filtered: list[Movie] = []
-    for m in movies:
-        if not isinstance(m, Movie):
-            continue
-        if genre and genre not in [g.tag for g in m.genres]:
-            continue
-        if content_rating and m.contentRating != content_rating:
-            continue
-        if decade:
-            decade_start = int(decade)
-            if not m.year or not (decade_start <= m.year < decade_start + 10):
-                continue
-        if min_rating and (m.audienceRating or 0) < min_rating:
-            continue
-        filtered.append(m)
-    return filtered
-
-
-def _get_playlist_movies(plex: PlexServer, rating_key: str) -> list:
-    for pl in plex.playlists():
-        if str(pl.ratingKey) == str(rating_key):
-            return pl.items()
-    return []
+    remember(plex, movies)
+    return movies
 
 
-def _movie_to_dict(m: Movie) -> dict:
-    return {
-        "title": m.title,
-        "year": m.year,
-        "rating_key": m.ratingKey,
-        "summary": m.summary or "",
-        "audience_rating": m.audienceRating,
-        "content_rating": m.contentRating or "",
-        "duration_minutes": round(m.duration / 60000) if m.duration else None,
-        "genres": [g.tag for g in m.genres],
-        "has_thumb": bool(m.thumb),
+def draw_movies(
+    plex: PlexServer,
+    *,
+    count: int = 3,
+    genre: str = "",
+    content_rating: str = "",
+    decade: str = "",
+    min_rating: float = 0,
+    playlist_key: str = "",
+    section_key: str = "",
+    weighting: str = "",
+    exclude: set[int] | None = None,
+) -> tuple[list[dict], int, float]:
+    """Like get_random_movies, but without recording the picks in the user's history.
+
+    Also returns how many candidates the picks were drawn from and their
+    total weight, so draws from several servers can be merged in proportion
+    (see federation.merge).
+    """
+    filters = {"genre": genre, "content_rating": content_rating, "decade": decade, "min_rating": min_rating}
+    if playlist_key:
+        # Playlists can't use server-side search, so filter a local table instead
+        segments = [playlist_cache.get_table(plex, playlist_key).segment(weighting, **filters)]
+    else:
+        sections = get_movie_sections(plex)
+        if section_key:
+            sections = [s for s in sections if s["key"] == str(section_key)]
+        if not sections:
+            return [], 0, 0.0
+
+        # Answer from the local indexes instead of a Plex search per roll
+        try:
+            indexes = [library_index.get_index(plex, s["key"]) for s in sections]
+        except NotFound:
+            # A library was removed since the section list was cached
+            invalidate_sections(plex)
+            raise
+        segments = library_index.segments_across(indexes, weighting, **filters)
+
+    chosen = library_index.draw(segments, count, exclude, history.history_for(plex))
+    return [table.row_dict(row) for table, row in chosen], *library_index.size(segments)
+
+
+def remember(plex: PlexServer, movies: list[dict]) -> None:
+    """Record movies as shown to this user, so the next draws avoid them."""
+    recent = history.history_for(plex)
+    if recent is not None:
+        recent.add(m["rating_key"] for m in movies)
+
+
+# Keys of a movie dict (built by LibraryIndex.row_dict); federated draws add "server_id"
+MOVIE_FIELDS = frozenset(
+    {
+        "title",
+        "year",
+        "rating_key",
+        "summary",
+        "audience_rating",
+        "content_rating",
+        "duration_minutes",
+        "genres",
+        "has_thumb",
+        "thumb_version",
+        "server_id",
     }
+)
@@ -0,0 +1,79 @@
+"""plex.tv API endpoints, the headers that identify this app to them, and
+cached server discovery."""
+
+import asyncio
+import logging
+import time
+
+from app import metrics
+from app.config import settings
+from app.services import cache
+from app.services.http_clients import plex_tv_request
+
+log = logging.getLogger("movienight")
+
+PLEX_PINS_URL = "https://plex.tv/api/v2/pins"
+PLEX_AUTH_URL = "https://app.plex.tv/auth#"
+PLEX_RESOURCES_URL = "https://plex.tv/api/v2/resources"
+
+PLEX_HEADERS = {
+    "Accept": "application/json",
+    "X-Plex-Product": settings.plex_app_name,
+    "X-Plex-Client-Identifier": settings.plex_app_client_id,
+}
+
+
+_refreshing: dict[str, asyncio.Task] = {}
+
+
+async def get_servers(token: str) -> list[dict]:
+    """Return the user's Plex servers as [{"name", "id", "urls": [{"uri", "label"}]}].
+
+    Cached per token. Once loaded, the list is served from the cache
+    immediately and refreshed in the background after RESOURCES_CACHE_TTL.
+    """
+    key = f"resources:{cache.token_hash(token)}"
+    hit = cache.cache.get(key)
+    if hit is None:
+        metrics.cache_miss("resources")
+        return await _load_servers(key, token)
+    metrics.cache_hit("resources")
+
+    stored_at, servers = hit
+    if time.time() - stored_at >= settings.resources_cache_ttl and key not in _refreshing:
+        _refreshing[key] = asyncio.create_task(_refresh(key, token))
+    return servers
+
+
+async def _refresh(key: str, token: str) -> None:
+    try:
+        await _load_servers(key, token)
+    except Exception as exc:
+        # Keep serving the cached list; the next visit retries
+        log.warning("plex_tv: refreshing server list failed: %s", exc)
+    finally:
+        _refreshing.pop(key, None)
+
+
+async def _load_servers(key: str, token: str) -> list[dict]:
+    headers = {**PLEX_HEADERS, "X-Plex-Token": token}
+    resp = await plex_tv_request("GET", PLEX_RESOURCES_URL, headers=headers, params={"includeHttps": "1"})
+    resp.raise_for_status()
+    resources = resp.json()
+
+    servers = []
+    for r in resources:
+        if r.get("provides") and "server" in r["provides"]:
+            connections = r.get("connections", [])
+            urls = []
+            for c in connections:
+                uri = c.get("uri")
+                if not uri:
+                    continue
+                local = c.get("local", False)
+                urls.append({"uri": uri, "label": "local" if local else "remote"})
+            if urls:
+                servers.append({"name": r["name"], "id": r.get("clientIdentifier", ""), "urls": urls})
+
+    cache.cache.set(key, servers, settings.resources_cache_ttl + settings.filter_cache_stale_ttl)
+    return servers
@@ -0,0 +1,194 @@
+"""On-disk cache of card-sized poster variants.
+
+Posters are fetched through Plex's `/photo/:/transcode` at the size the card
+actually renders (plus a 2x variant for high-DPI screens). They are stored
+under `<cache dir>/<machine id>/<rating key>-<thumb version>-<size>.jpg`.
+Plex bumps the thumb version whenever the artwork changes, so cached files
+never need revalidation. Total size is kept under a byte budget by evicting
+the least recently served files.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from app import metrics
+from app.config import settings
+from app.services.http_clients import plex_client
+
+log = logging.getLogger("movienight")
+
+# Variant name -> (width, height); cards are 2:3 tiles about 400px wide
+POSTER_SIZES = {
+    "card": (400, 600),
+    "card2x": (800, 1200),
+}
+
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class PosterCache:
+    """Byte-budgeted LRU of poster files on disk."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._files: OrderedDict[Path, int] = OrderedDict()  # path -> size, LRU first
+        self._total = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def path_for(self, machine_id: str, rating_key: str, version: str, size: str) -> Path | None:
+        """Return the cache path for a variant, or None if the key isn't cacheable."""
+        if size not in POSTER_SIZES or not all(_SAFE_ID.match(p) for p in (machine_id, rating_key, version)):
+            return None
+        return self.root / machine_id / f"{rating_key}-{version}-{size}.jpg"
+
+    def load(self) -> None:
+        """Index the files already on disk (otherwise done lazily on first use)."""
+        with self._lock:
+            self._load()
+
+    def get(self, path: Path) -> bool:
+        """Return True (and mark the file recently used) if `path` is cached."""
+        with self._lock:
+            self._load()
+            if path not in self._files:
+                return False
+            self._files.move_to_end(path)
+        try:
+            # Keep mtime in LRU order so it survives restarts
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(path)
+            return False
+        return True
+
+    def put(self, path: Path, data: bytes) -> None:
+        """Atomically write `data` to `path` and evict down to the byte budget."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self._load()
+            self._total -= self._files.pop(path, 0)
+            self._files[path] = len(data)
+            self._total += len(data)
+            evicted = self._evict()
+        for old in evicted:
+            old.unlink(missing_ok=True)
+
+    def _forget(self, path: Path) -> None:
+        with self._lock:
+            self._total -= self._files.pop(path, 0)
+
+    def _evict(self) -> list[Path]:
+        evicted = []
+        while self._total > self.max_bytes and len(self._files) > 1:
+            old, size = self._files.popitem(last=False)
+            self._total -= size
+            evicted.append(old)
+        return evicted
+
+    def _load(self) -> None:
+        """Index whatever is already on disk, oldest first (caller holds the lock)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        found = []
+        for path in self.root.glob("*/*.jpg"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._files[path] = size
+            self._total += size
+        for old in self._evict():
+            old.unlink(missing_ok=True)
+        log.info("poster_cache: %d files, %d bytes in %s", len(self._files), self._total, self.root)
+
+
+cache = PosterCache(Path(settings.poster_cache_dir), settings.poster_cache_max_bytes)
+
+# In-flight fetches, so concurrent misses for one poster hit Plex once
+_pending: dict[Path, asyncio.Future] = {}
+
+
+async def get_or_fetch(
+    base_url: str, token: str, machine_id: str, rating_key: str, version: str, size: str
+) -> Path | None:
+    """Return the cached file for a poster variant, fetching it from Plex on a miss.
+
+    Returns None if the variant can't be cached or Plex didn't return an image.
+    """
+    if not settings.poster_cache_dir:
+        return None
+    path = cache.path_for(machine_id, rating_key, version, size)
+    if path is None:
+        return None
+    if cache.get(path):
+        metrics.cache_hit("posters")
+        return path
+    metrics.cache_miss("posters")
+
+    pending = _pending.get(path)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    fut = _pending[path] = asyncio.get_running_loop().create_future()
+    try:
+        result = await _fetch(base_url, token, path, rating_key, version, size)
+        fut.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as exc:
+        fut.set_exception(exc)
+        fut.exception()  # mark retrieved in case nobody else was waiting
+        raise
+    finally:
+        del _pending[path]
+
+
+async def _fetch(base_url: str, token: str, path: Path, rating_key: str, version: str, size: str) -> Path | None:
+    width, height = POSTER_SIZES[size]
+    try:
+        with metrics.timed_call("GET /photo/:/transcode", base_url):
+            resp = await plex_client(base_url).get(
+                f"{base_url}/photo/:/transcode",
+                params={
+                    "url": f"/library/metadata/{rating_key}/thumb/{version}",
+                    "width": width,
+                    "height": height,
+                    "minSize": 1,
+                    "upscale": 1,
+                    "X-Plex-Token": token,
+                },
+                follow_redirects=True,
+            )
+    except httpx.HTTPError as exc:
+        log.warning("poster_cache: fetch failed for %s: %s", rating_key, exc)
+        return None
+    if resp.status_code != 200 or not resp.headers.get("content-type", "").startswith("image/"):
+        return None
+
+    await run_in_threadpool(cache.put, path, resp.content)
+    return path
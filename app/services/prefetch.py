@@ -0,0 +1,132 @@
+"""Precomputed draws so a re-roll can be answered from memory.
+
+After each roll, the next PREFETCH_DEPTH draws for the same filters are
+computed in the background, and their posters are warmed in the poster
+cache. A queue belongs to one login on one server. It is emptied as soon as
+that user rolls with different filters.
+
+Queued draws don't count as shown: they go into the user's recent history
+only when `take` serves them, and queued draws never overlap each other.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from plexapi.server import PlexServer
+from starlette.concurrency import run_in_threadpool
+
+from app import metrics
+from app.config import settings
+from app.services import cache, plex_service, poster_cache
+from app.services.cache import token_hash
+from app.services.plex_executor import run_plex
+
+log = logging.getLogger("movienight")
+
+_MAX_AGE = 300  # drop prefetched draws older than this, they may predate library changes
+_MAX_QUEUES = 1024
+
+
+@dataclass
+class _Queue:
+    params: dict
+    draws: deque[tuple[float, list[dict]]] = field(default_factory=deque)  # (made_at wall time, movies)
+    filling: asyncio.Task | None = None
+
+
+_queues: OrderedDict[str, _Queue] = OrderedDict()
+
+
+def _key(plex: PlexServer) -> str:
+    return f"{plex.machineIdentifier}:{token_hash(plex._token)}"
+
+
+async def take(plex: PlexServer, params: dict) -> list[dict] | None:
+    """Pop a prefetched draw for these filters, or None if there isn't one ready."""
+    queue = _queues.get(_key(plex))
+    if queue is not None and queue.params == params and queue.draws:
+        now = time.time()
+        # Another worker may have seen the library change (the SQLite cache reads from disk)
+        hit = await run_in_threadpool(cache.cache.get, f"prefetch-stale:{plex.machineIdentifier}")
+        changed_at = hit[1] if hit else 0.0
+        while queue.draws:
+            made_at, movies = queue.draws.popleft()
+            if now - made_at < _MAX_AGE and made_at > changed_at:
+                metrics.cache_hit("prefetch")
+                plex_service.remember(plex, movies)
+                return movies
+    metrics.cache_miss("prefetch")
+    return None
+
+
+def refill(plex: PlexServer, params: dict) -> None:
+    """Start topping up the queue for these filters in the background."""
+    if settings.prefetch_depth <= 0:
+        return
+    key = _key(plex)
+    queue = _queues.get(key)
+    if queue is None or queue.params != params:
+        if queue is not None and queue.filling is not None:
+            queue.filling.cancel()
+        queue = _queues[key] = _Queue(dict(params))
+    _queues.move_to_end(key)
+    while len(_queues) > _MAX_QUEUES:
+        _, evicted = _queues.popitem(last=False)
+        if evicted.filling is not None:
+            evicted.filling.cancel()
+
+    if queue.filling is None and len(queue.draws) < settings.prefetch_depth:
+        queue.filling = asyncio.create_task(_fill(queue, plex))
+
+
+async def _fill(queue: _Queue, plex: PlexServer) -> None:
+    try:
+        while len(queue.draws) < settings.prefetch_depth:
+            # Skip movies already queued, so consecutive re-rolls don't repeat each other
+            queued = {m["rating_key"] for _, draw in queue.draws for m in draw}
+            started = time.time()
+            movies, _, _ = await run_plex(
+                plex._baseurl, plex_service.draw_movies, plex, exclude=queued, **queue.params
+            )
+            queue.draws.append((started, movies))
+            await _warm_posters(plex, movies)
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        # Nothing lost: the next roll just runs the draw itself
+        log.warning("prefetch: drawing ahead failed: %s", exc)
+    finally:
+        queue.filling = None
+
+
+async def _warm_posters(plex: PlexServer, movies: list[dict]) -> None:
+    await asyncio.gather(
+        *(
+            poster_cache.get_or_fetch(
+                plex._baseurl, plex._token, plex.machineIdentifier, str(m["rating_key"]), m["thumb_version"], size
+            )
+            for m in movies
+            if m.get("thumb_version")
+            for size in poster_cache.POSTER_SIZES
+        ),
+        return_exceptions=True,
+    )
+
+
+def invalidate(machine_id: str) -> None:
+    """Drop prefetched draws for a server whose library changed, in this and every other worker."""
+    cache.cache.set(f"prefetch-stale:{machine_id}", time.time(), _MAX_AGE)
+    for key in [k for k in _queues if k.startswith(f"{machine_id}:")]:
+        queue = _queues.pop(key)
+        if queue.filling is not None:
+            queue.filling.cancel()
+
+
+async def shutdown() -> None:
+    for queue in _queues.values():
+        if queue.filling is not None:
+            queue.filling.cancel()
+    _queues.clear()
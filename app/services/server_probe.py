@@ -0,0 +1,159 @@
+"""Pick a Plex server's connection URL by racing all of them.
+
+plex.tv lists several connections per server (local, remote, relay, and
+plex.direct variants). The labels and ports say little about which ones
+actually work from here. Every candidate gets a concurrent `/identity`
+probe, and the first to answer wins, i.e. the lowest-latency reachable URL.
+The slower probes keep running in the background to fill in the ranking.
+Results are cached per server (machine identifier). They are re-probed in
+the background once stale, and again right away when the active URL starts
+failing.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+import httpx
+
+from app import metrics
+from app.config import settings
+from app.services import plex_tv
+from app.services.http_clients import probe_client
+from app.services.plex_pool import skip_tls_verify
+
+log = logging.getLogger("movienight")
+
+
+@dataclass
+class _Server:
+    uris: list[str]
+    latencies: dict[str, float | None] = field(default_factory=dict)  # None = unreachable
+    probed_at: float = 0.0
+    refreshing: bool = False
+    racing: asyncio.Task | None = None
+
+    def best(self) -> str | None:
+        reachable = [(lat, uri) for uri, lat in self.latencies.items() if lat is not None]
+        return min(reachable)[1] if reachable else None
+
+
+_servers: dict[str, _Server] = {}
+_background: set[asyncio.Task] = set()
+_UNREACHABLE_TTL = 15  # seconds before a server with no reachable URL is raced again
+
+
+async def probe(uri: str, token: str) -> float | None:
+    """Return the round-trip time of `uri`'s /identity in seconds, or None if unreachable."""
+    started = time.monotonic()
+    try:
+        resp = await probe_client(not skip_tls_verify(uri)).get(
+            f"{uri}/identity",
+            headers={"X-Plex-Token": token, "Accept": "application/json"},
+            timeout=settings.probe_timeout,
+        )
+    except httpx.HTTPError as exc:
+        metrics.observe_call("probe", uri, time.monotonic() - started, type(exc).__name__)
+        return None
+    latency = time.monotonic() - started
+    if resp.status_code != 200:
+        metrics.observe_call("probe", uri, latency, str(resp.status_code))
+        return None
+    metrics.observe_call("probe", uri, latency)
+    return latency
+
+
+async def _race(server: _Server, token: str, skip: str | None = None) -> str | None:
+    """Probe every URL at once and return the first reachable one."""
+    server.probed_at = time.monotonic()
+
+    async def run(uri: str) -> str | None:
+        latency = await probe(uri, token)
+        server.latencies[uri] = latency
+        return uri if latency is not None else None
+
+    tasks = [asyncio.create_task(run(uri)) for uri in server.uris if uri != skip]
+    # Let the losers finish in the background so the ranking stays complete
+    _background.update(tasks)
+    for task in tasks:
+        task.add_done_callback(_background.discard)
+
+    for next_done in asyncio.as_completed(tasks):
+        uri = await next_done
+        if uri is not None:
+            return uri
+    return None
+
+
+def _refresh(server: _Server, token: str) -> None:
+    if server.refreshing:
+        return
+    server.refreshing = True
+
+    async def run():
+        try:
+            latencies = await asyncio.gather(*(probe(uri, token) for uri in server.uris))
+            server.latencies = dict(zip(server.uris, latencies))
+            server.probed_at = time.monotonic()
+        finally:
+            server.refreshing = False
+
+    task = asyncio.create_task(run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def best_url(machine_id: str, uris: list[str], token: str) -> str | None:
+    """Return the fastest reachable URL for a server, probing only when needed."""
+    server = _servers.get(machine_id)
+    if server is None or set(server.uris) != set(uris):
+        server = _servers[machine_id] = _Server(list(uris))
+        return await _join_race(server, token)
+    if server.racing is not None and not server.racing.done():
+        return await _join_race(server, token)
+
+    best = server.best()
+    age = time.monotonic() - server.probed_at
+    if best is None:
+        # Nothing answered last time; retry soon, the outage may have been a blip
+        return await _join_race(server, token) if age >= _UNREACHABLE_TTL else None
+    if age >= settings.probe_ttl:
+        _refresh(server, token)
+    return best
+
+
+async def _join_race(server: _Server, token: str) -> str | None:
+    """Race the server's URLs, or wait for the race another request already started."""
+    if server.racing is None or server.racing.done():
+        server.racing = asyncio.create_task(_race(server, token))
+    return await asyncio.shield(server.racing)
+
+
+def record(machine_id: str, uri: str, latency: float | None) -> None:
+    """Store a probe result made elsewhere (e.g. the server picker's live badges)."""
+    server = _servers.get(machine_id)
+    if server is not None and uri in server.uris:
+        server.latencies[uri] = latency
+
+
+async def failover(machine_id: str, failed_uri: str, token: str) -> str | None:
+    """Mark `failed_uri` down and race the server's other URLs for a replacement.
+
+    Works without an earlier `best_url` in this process (after a restart, or
+    in another worker): the server's URLs are then looked up on plex.tv.
+    """
+    server = _servers.get(machine_id)
+    if server is None:
+        try:
+            servers = await plex_tv.get_servers(token)
+        except Exception as exc:
+            log.warning("server_probe: can't list connections for %s: %s", machine_id, exc)
+            return None
+        match = next((s for s in servers if s["id"] == machine_id), None)
+        if match is None:
+            return None
+        server = _servers[machine_id] = _Server([u["uri"] for u in match["urls"]])
+    server.latencies[failed_uri] = None
+    log.warning("server_probe: %s failed for %s, re-probing", failed_uri, machine_id)
+    return await _race(server, token, skip=failed_uri)
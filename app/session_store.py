@@ -1,24 +1,59 @@
 """Cookie-based session middleware. Session data is stored in a signed cookie
-so it survives server restarts (important for --reload during development)."""
+so it survives server restarts (important for --reload during development).
+
+With SESSION_BACKEND set to "memory" or "sqlite", the data is kept
+server-side instead, and the signed cookie only carries a session id. Then
+per-user state can outlive a request without growing the cookie:
+
+- memory: an in-process LRU. The session dict itself is stored, so any
+  object survives between requests.
+- sqlite: a WAL-mode file shared by all workers on the host. It stores the
+  JSON-serializable keys that don't start with "_".
+
+This is a plain ASGI middleware rather than a BaseHTTPMiddleware, so it adds
+no extra task or stream wrapping per request. The cookie is only decoded
+when a handler first touches the session, and `Set-Cookie` is only sent
+when the session actually changed.
+"""
+
+import json
+import secrets
+import time
+from collections.abc import Iterator, MutableMapping
+from pathlib import Path
+from typing import Any
 
 from itsdangerous import BadSignature, URLSafeSerializer
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.requests import Request
-from starlette.responses import Response
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request, cookie_parser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.config import settings
+from app.services.cache import Cache, MemoryCache, SQLiteCache
 
 COOKIE_NAME = "mn_session"
 MAX_AGE = 60 * 60 * 24 * 7  # 7 days
+TOUCH_AFTER = 60 * 60 * 24  # re-save server-side sessions at most daily to slide their expiry
 
 # Keys that are safe to persist in the cookie (no large objects)
-_PERSIST_KEYS = {"plex_token", "server_url", "server_name", "pin_id", "pin_code"}
+_PERSIST_KEYS = {"plex_token", "server_url", "server_name", "server_id", "federated_ids", "pin_id", "pin_code"}
 
 _signer = URLSafeSerializer(settings.secret_key, salt="session")
 
 
-def _load_session(request: Request) -> dict:
-    raw = request.cookies.get(COOKIE_NAME)
+def _make_store() -> Cache | None:
+    if settings.session_backend == "memory":
+        return MemoryCache(settings.session_store_max)
+    if settings.session_backend == "sqlite":
+        return SQLiteCache(Path(settings.session_store_path), settings.session_store_max)
+    return None
+
+
+_store = _make_store()
+
+
+def _load_session(raw: str | None) -> dict:
     if not raw:
         return {}
     try:
@@ -30,26 +65,155 @@ def _load_session(request: Request) -> dict:
     return {}
 
 
-class SessionMiddleware(BaseHTTPMiddleware):
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        session = _load_session(request)
-        request.state.session = session
-
-        response = await call_next(request)
-
-        # Only persist safe keys into the cookie
-        to_persist = {k: v for k, v in session.items() if k in _PERSIST_KEYS}
-        signed = _signer.dumps(to_persist)
-        response.set_cookie(
-            COOKIE_NAME,
-            signed,
-            max_age=MAX_AGE,
-            httponly=True,
-            samesite="lax",
-        )
-        return response
+def _persisted(data: dict) -> dict:
+    if _store is None:
+        return {k: v for k, v in data.items() if k in _PERSIST_KEYS}
+    # Underscore keys hold live objects; only the memory store can keep those
+    return {k: v for k, v in data.items() if not k.startswith("_")}
+
+
+def _snapshot(data: dict) -> str:
+    return json.dumps(_persisted(data), sort_keys=True, default=str)
+
+
+class Session(MutableMapping):
+    """Session dict that decodes its cookie (and loads server-side data) on first access."""
+
+    def __init__(self, raw: str | None):
+        self._raw = raw
+        self._data: dict | None = None
+        self._original = ""
+        self.sid: str | None = None
+        self.stored_at = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._load()
+        return self._data
+
+    async def load(self) -> None:
+        """Load the session now, in a worker thread (the SQLite store reads from disk)."""
+        if self._data is None:
+            await run_in_threadpool(self._load)
+
+    def _load(self) -> None:
+        payload = _load_session(self._raw)
+        data = payload
+        if _store is not None:
+            data = {}
+            sid = payload.get("sid")
+            hit = _store.get(f"session:{sid}") if isinstance(sid, str) else None
+            if hit is not None:
+                self.sid = sid
+                self.stored_at, data = hit
+        self._original = _snapshot(data)
+        self._data = data
+
+    def changed(self) -> bool:
+        """True if any persisted key differs from what was loaded."""
+        return self.loaded and _snapshot(self._data) != self._original
+
+    def stale(self) -> bool:
+        """True if a server-side session is due for an expiry refresh."""
+        return self.sid is not None and time.time() - self.stored_at > TOUCH_AFTER
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.data[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self.data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def clear(self) -> None:
+        self.data.clear()
+
+
+def _read_cookie(scope: Scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            return cookie_parser(value.decode("latin-1")).get(COOKIE_NAME)
+    return None
+
+
+def _cookie_header(payload: dict) -> str:
+    signed = _signer.dumps(payload)
+    return f"{COOKIE_NAME}={signed}; HttpOnly; Max-Age={MAX_AGE}; Path=/; SameSite=lax"
+
+
+_DELETE_COOKIE = f"{COOKIE_NAME}=; Max-Age=0; Path=/; SameSite=lax"
+
+
+async def _save_server_side(session: Session) -> str | None:
+    """Write a changed session to the store; return the Set-Cookie value, if any."""
+    data = session.data
+    old_sid = session.sid
+    if not _persisted(data) and not (isinstance(_store, MemoryCache) and data):
+        if old_sid:
+            await run_in_threadpool(_store.delete, f"session:{old_sid}")
+        return _DELETE_COOKIE if session._raw else None
+
+    sid = old_sid
+    # New login or new user: issue a fresh id so a pre-login id can't be reused
+    if sid is None or json.loads(session._original).get("plex_token") != data.get("plex_token"):
+        sid = secrets.token_urlsafe(24)
+        if old_sid:
+            await run_in_threadpool(_store.delete, f"session:{old_sid}")
+    value = data if isinstance(_store, MemoryCache) else _persisted(data)
+    await run_in_threadpool(_store.set, f"session:{sid}", value, MAX_AGE)
+    # The cookie only needs re-sending for a new id or to slide its expiry
+    if sid != old_sid or session.stale():
+        return _cookie_header({"sid": sid})
+    return None
+
+
+class SessionMiddleware:
+    def __init__(self, app: ASGIApp, exclude_prefixes: tuple[str, ...] = ("/static/",)):
+        self.app = app
+        self.exclude_prefixes = exclude_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        raw = _read_cookie(scope)
+        session = Session(raw)
+        if raw and isinstance(_store, SQLiteCache):
+            # Keep the disk read off the event loop; other backends load lazily on first use
+            await session.load()
+        scope.setdefault("state", {})["session"] = session
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start" and (session.changed() or session.stale()):
+                headers = MutableHeaders(scope=message)
+                # Leave it alone if the handler set or deleted the cookie itself (logout)
+                handled = any(v.startswith(f"{COOKIE_NAME}=") for v in headers.getlist("set-cookie"))
+                if _store is not None:
+                    cookie = await _save_server_side(session)
+                elif not handled:
+                    # Only persist safe keys into the cookie
+                    to_persist = _persisted(session.data)
+                    cookie = _cookie_header(to_persist) if to_persist else (_DELETE_COOKIE if raw else None)
+                else:
+                    cookie = None
+                if cookie and not handled:
+                    headers.append("set-cookie", cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
 
 
 def clear_session(request: Request) -> None:
@@ -0,0 +1,177 @@
+"""Shared Jinja environment and helpers for HTMX fragment responses.
+
+Every router renders through the one `templates` instance, so each template
+is compiled once per process. Compiled bytecode is also kept on disk
+(TEMPLATE_CACHE_DIR), so a restarted worker skips the Jinja compile step.
+
+Fragments go out through `fragment_response`, which negotiates
+brotli/gzip compression and answers matching `If-None-Match` requests
+with 304. Fragments whose inputs rarely change (the filter form) are
+memoized as finished responses keyed by a hash of those inputs. A repeat
+request then costs neither a render nor a compression pass.
+
+Clients that ask for JSON (`Accept: application/json` or `?format=json`)
+get the same data as compact JSON through the same path, with the same
+ETags and compression. JSON is encoded with orjson when it is installed.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import jinja2
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.templating import Jinja2Templates
+
+from app import metrics
+from app.config import settings
+
+try:
+    import brotli
+except ImportError:  # optional: pip install movienight[brotli]
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # optional: pip install movienight[json]
+    orjson = None
+
+
+def _make_env() -> jinja2.Environment:
+    bytecode_cache = None
+    if settings.template_cache_dir:
+        path = Path(settings.template_cache_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(str(path))
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader("app/templates"),
+        autoescape=True,
+        bytecode_cache=bytecode_cache,
+        auto_reload=settings.template_auto_reload,
+    )
+
+
+templates = Jinja2Templates(env=_make_env())
+
+_MIN_COMPRESS = 512  # bytes; smaller bodies aren't worth the encoding header
+
+
+class Fragment:
+    """A rendered fragment with its ETag and lazily built compressed bodies."""
+
+    def __init__(self, body: bytes, etag: str, media_type: str = "text/html"):
+        self.body = body
+        self.etag = etag
+        self.media_type = media_type
+        self._encoded: dict[str, bytes] = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        data = self._encoded.get(encoding)
+        if data is None:
+            if encoding == "br":
+                data = brotli.compress(self.body, quality=settings.compress_level_br)
+            else:
+                data = gzip.compress(self.body, compresslevel=settings.compress_level_gzip)
+            self._encoded[encoding] = data
+        return data
+
+
+def _pick_encoding(request: Request, size: int) -> str | None:
+    if size < _MIN_COMPRESS:
+        return None
+    accepted = {e.split(";")[0].strip() for e in request.headers.get("accept-encoding", "").split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def fragment_response(request: Request, fragment: Fragment, status_code: int = 200) -> Response:
+    """Send a fragment, compressed if the client accepts it, or a 304 if its ETag matches."""
+    headers = {
+        "ETag": fragment.etag,
+        "Vary": "Accept, Accept-Encoding, Cookie",
+        "Cache-Control": "private, no-cache",
+    }
+    if fragment.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    encoding = _pick_encoding(request, len(fragment.body))
+    if encoding is None:
+        return Response(fragment.body, status_code=status_code, media_type=fragment.media_type, headers=headers)
+    headers["Content-Encoding"] = encoding
+    return Response(
+        fragment.encoded(encoding), status_code=status_code, media_type=fragment.media_type, headers=headers
+    )
+
+
+def render_fragment(name: str, context: dict[str, Any]) -> Fragment:
+    body = templates.get_template(name).render(context).encode()
+    return Fragment(body, f'"{hashlib.sha1(body).hexdigest()[:20]}"')
+
+
+def wants_json(request: Request) -> bool:
+    """True if the client prefers JSON to an HTML fragment (`?format=json` or its Accept header)."""
+    if request.query_params.get("format") == "json":
+        return True
+    quality: dict[str, float] = {}
+    for part in request.headers.get("accept", "").split(","):
+        media_type, *params = (p.strip() for p in part.split(";"))
+        q = next((p[2:] for p in params if p.startswith("q=")), "1")
+        try:
+            quality[media_type] = float(q)
+        except ValueError:
+            continue
+    html = quality.get("text/html", quality.get("text/*", quality.get("*/*", 0.0)))
+    return quality.get("application/json", 0.0) > html
+
+
+def dumps(data: Any) -> bytes:
+    """Compact JSON, with orjson if available."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def json_fragment(data: Any) -> Fragment:
+    body = dumps(data)
+    return Fragment(body, f'"{hashlib.sha1(body).hexdigest()[:20]}"', "application/json")
+
+
+_memo: OrderedDict[str, Fragment] = OrderedDict()
+_memo_lock = threading.Lock()
+_MEMO_MAX = 256
+
+
+def memoized_fragment(name: str, context: dict[str, Any]) -> Fragment:
+    """Render `name` once per distinct (JSON-serializable) context and reuse the result."""
+    return _memoized([name, context], lambda: render_fragment(name, context))
+
+
+def memoized_json(data: dict[str, Any]) -> Fragment:
+    """`json_fragment`, encoded once per distinct `data` and reused."""
+    return _memoized(["json", data], lambda: json_fragment(data))
+
+
+def _memoized(inputs: list, build) -> Fragment:
+    key = hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+    with _memo_lock:
+        fragment = _memo.get(key)
+        if fragment is not None:
+            _memo.move_to_end(key)
+            metrics.cache_hit("fragments")
+            return fragment
+    metrics.cache_miss("fragments")
+    fragment = build()
+    # The context hash identifies the content, so it doubles as a stable ETag
+    fragment.etag = f'"{key[:20]}"'
+    with _memo_lock:
+        _memo[key] = fragment
+        while len(_memo) > _MEMO_MAX:
+            _memo.popitem(last=False)
+    return fragment
@@ -0,0 +1,244 @@
+"""A stand-in Plex Media Server for offline benchmarks.
+
+It serves the subset of the Plex API this app uses:
+
+- the server root and `/identity`
+- library sections, with paging, `addedAt:desc` sorting, `updatedAt>>=` deltas
+  and watch-state queries
+- filter directories
+- playlists
+- poster thumbs and `/photo/:/transcode`
+
+The library is generated deterministically from `--movies`, so a load
+driver can compute valid rating keys and thumb versions with `movie(i)`
+without asking the server.
+
+Faults can be injected:
+
+- `--latency-ms` adds a delay to every response (with +/-50% jitter).
+- `--fail-rate` answers that fraction of requests with a 500.
+- `--stall` never answers at all, like a server that is up at the TCP
+  level but hung.
+
+    python -m bench.fake_plex --port 32400 --movies 20000 --latency-ms 20
+"""
+
+import argparse
+import asyncio
+import random
+from dataclasses import dataclass
+from xml.sax.saxutils import quoteattr
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+MACHINE_ID = "benchfakeplex"
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary", "Drama", "Family",
+          "Fantasy", "History", "Horror", "Music", "Mystery", "Romance", "Science Fiction", "Thriller",
+          "War", "Western"]
+CONTENT_RATINGS = ["G", "PG", "PG-13", "R", "NC-17", "NR"]
+BASE_TIMESTAMP = 1_600_000_000
+FIRST_RATING_KEY = 1000
+
+# Opaque bytes with an image content type; the app never decodes posters
+_POSTER = b"\xff\xd8\xff\xe0" + random.Random(0).randbytes(30_000) + b"\xff\xd9"
+
+
+@dataclass
+class Config:
+    movies: int = 10_000
+    sections: int = 1
+    playlists: int = 5
+    playlist_size: int = 200
+    latency_ms: float = 0
+    fail_rate: float = 0
+    stall: bool = False
+    machine_id: str = MACHINE_ID
+    name: str = "Bench Plex"
+
+
+def movie(i: int) -> dict:
+    """Attributes of the i-th generated movie (stable across runs)."""
+    rng = random.Random(i)
+    return {
+        "ratingKey": FIRST_RATING_KEY + i,
+        "title": f"Movie {i}",
+        "year": 1950 + i % 75,
+        "contentRating": CONTENT_RATINGS[i % len(CONTENT_RATINGS)],
+        "audienceRating": round(rng.uniform(3, 9.8), 1),
+        "duration": rng.randint(80, 180) * 60_000,
+        "addedAt": BASE_TIMESTAMP + i * 60,
+        "updatedAt": BASE_TIMESTAMP + i * 60,
+        "thumbVersion": BASE_TIMESTAMP + i,
+        "genres": rng.sample(GENRES, rng.randint(1, 3)),
+        "summary": f"Synthetic plot summary number {i}. " * 4,
+    }
+
+
+def _video_xml(i: int) -> str:
+    m = movie(i)
+    genres = "".join(f"<Genre tag={quoteattr(g)}/>" for g in m["genres"])
+    return (
+        f'<Video type="movie" ratingKey="{m["ratingKey"]}" key="/library/metadata/{m["ratingKey"]}"'
+        f' title={quoteattr(m["title"])} year="{m["year"]}" contentRating="{m["contentRating"]}"'
+        f' audienceRating="{m["audienceRating"]}" duration="{m["duration"]}" addedAt="{m["addedAt"]}"'
+        f' updatedAt="{m["updatedAt"]}" summary={quoteattr(m["summary"])}'
+        f' thumb="/library/metadata/{m["ratingKey"]}/thumb/{m["thumbVersion"]}">{genres}</Video>'
+    )
+
+
+def _xml(body: str, **attrs) -> Response:
+    attr_text = "".join(f" {k}={quoteattr(str(v))}" for k, v in attrs.items())
+    return Response(
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<MediaContainer{attr_text}>{body}</MediaContainer>',
+        media_type="application/xml",
+    )
+
+
+def _paging(request: Request, total: int) -> tuple[int, int]:
+    def read(name: str, default: int) -> int:
+        value = request.query_params.get(name) or request.headers.get(name)
+        return int(value) if value is not None else default
+
+    return read("X-Plex-Container-Start", 0), read("X-Plex-Container-Size", total)
+
+
+def build_app(config: Config) -> Starlette:
+    def section_range(key: str) -> range:
+        # Movies are dealt round-robin into sections 1..N
+        index = int(key) - 1
+        return range(index, config.movies, config.sections)
+
+    def playlist_range(key: int) -> range:
+        start = (key - 1) * config.playlist_size
+        return range(start, min(start + config.playlist_size, config.movies))
+
+    async def root(request: Request) -> Response:
+        return _xml("", machineIdentifier=config.machine_id, friendlyName=config.name, version="1.40.0.0",
+                    platform="Linux", size=0)
+
+    async def identity(request: Request) -> Response:
+        return _xml("", machineIdentifier=config.machine_id, version="1.40.0.0", size=0)
+
+    async def sections(request: Request) -> Response:
+        body = "".join(
+            f'<Directory key="{k}" type="movie" title="Movies {k}" agent="tv.plex.agents.movie"/>'
+            for k in range(1, config.sections + 1)
+        )
+        return _xml(body, size=config.sections)
+
+    async def section_all(request: Request) -> Response:
+        rows = section_range(request.path_params["key"])
+        since = request.query_params.get("updatedAt>>")
+        if since is not None:
+            # The app asks for `updatedAt>>=<ts>`, which parses as key "updatedAt>>" value "<ts>"
+            rows = [i for i in rows if movie(i)["updatedAt"] > int(since)]
+        if "lastViewedAt>>" in request.query_params or request.query_params.get("unwatched") == "0":
+            rows = []  # nothing in the generated library has been watched
+        if request.query_params.get("sort") == "addedAt:desc":
+            rows = rows[::-1]  # addedAt grows with the movie number
+        start, size = _paging(request, len(rows))
+        page = rows[start:start + size]
+        return _xml("".join(_video_xml(i) for i in page), size=len(page), totalSize=len(rows),
+                    librarySectionID=request.path_params["key"])
+
+    async def section_filter(request: Request) -> Response:
+        field = request.path_params["field"]
+        if field == "genre":
+            values = GENRES
+        elif field == "contentRating":
+            values = CONTENT_RATINGS
+        elif field == "decade":
+            values = [str(d) for d in range(1950, 2030, 10)]
+        else:
+            return Response(status_code=404)
+        body = "".join(f"<Directory key={quoteattr(v)} title={quoteattr(v)}/>" for v in values)
+        return _xml(body, size=len(values))
+
+    def playlist_xml(key: int) -> str:
+        return (
+            f'<Playlist type="playlist" ratingKey="{key}" key="/playlists/{key}/items"'
+            f' title="Playlist {key}" playlistType="video" smart="0"'
+            f' leafCount="{len(playlist_range(key))}" updatedAt="{BASE_TIMESTAMP}"/>'
+        )
+
+    async def playlists(request: Request) -> Response:
+        keys = range(1, config.playlists + 1)
+        start, size = _paging(request, len(keys))
+        page = keys[start:start + size]
+        return _xml("".join(playlist_xml(k) for k in page), size=len(page), totalSize=len(keys))
+
+    async def playlist(request: Request) -> Response:
+        key = int(request.path_params["key"])
+        if not 1 <= key <= config.playlists:
+            return Response(status_code=404)
+        return _xml(playlist_xml(key), size=1)
+
+    async def playlist_items(request: Request) -> Response:
+        key = int(request.path_params["key"])
+        if not 1 <= key <= config.playlists:
+            return Response(status_code=404)
+        rows = playlist_range(key)
+        return _xml("".join(_video_xml(i) for i in rows), size=len(rows), totalSize=len(rows))
+
+    async def poster(request: Request) -> Response:
+        return Response(_POSTER, media_type="image/jpeg", headers={"ETag": '"bench-poster"'})
+
+    app = Starlette(
+        routes=[
+            Route("/", root),
+            Route("/identity", identity),
+            Route("/library/sections", sections),
+            Route("/library/sections/{key:int}/all", section_all),
+            Route("/library/sections/{key:int}/{field}", section_filter),
+            Route("/playlists", playlists),
+            Route("/playlists/{key:int}", playlist),
+            Route("/playlists/{key:int}/items", playlist_items),
+            Route("/library/metadata/{key:int}/thumb", poster),
+            Route("/library/metadata/{key:int}/thumb/{version}", poster),
+            Route("/photo/:/transcode", poster),
+        ]
+    )
+
+    inner = app
+
+    async def with_faults(scope, receive, send):
+        if scope["type"] == "http":
+            if config.stall:
+                await asyncio.Event().wait()  # hang until the client gives up
+            if config.latency_ms:
+                await asyncio.sleep(config.latency_ms / 1000 * random.uniform(0.5, 1.5))
+            if config.fail_rate and random.random() < config.fail_rate:
+                await Response("injected failure", status_code=500)(scope, receive, send)
+                return
+        await inner(scope, receive, send)
+
+    return with_faults
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=32400)
+    parser.add_argument("--movies", type=int, default=Config.movies)
+    parser.add_argument("--sections", type=int, default=Config.sections)
+    parser.add_argument("--playlists", type=int, default=Config.playlists)
+    parser.add_argument("--playlist-size", type=int, default=Config.playlist_size)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0)
+    parser.add_argument("--stall", action="store_true")
+    parser.add_argument("--machine-id", default=MACHINE_ID, help="to run several distinct servers side by side")
+    parser.add_argument("--name", default=Config.name)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = Config(args.movies, args.sections, args.playlists, args.playlist_size,
+                    args.latency_ms, args.fail_rate, args.stall, args.machine_id, args.name)
+    uvicorn.run(build_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
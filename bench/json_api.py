@@ -0,0 +1,71 @@
+"""Microbenchmark: JSON responses against the HTML fragments they replace.
+
+For roll sizes of 3, 10 and 50 movies it compares the movie_cards render
+with JSON encoding, using orjson (if installed) and the stdlib encoder, for
+every field and for a `fields=rating_key,title,year` selection. It lists
+encode time and body size, raw and gzipped. The filter form is compared
+the same way.
+
+    python -m bench.json_api [--calls 2000]
+"""
+
+import argparse
+import gzip
+import json
+
+from app.templating import json_fragment, orjson, render_fragment
+from bench.templates import FILTERS, per_call
+
+FIELDS = ["rating_key", "title", "year"]
+
+
+def movies(n: int) -> list[dict]:
+    return [
+        {
+            "title": f"Movie {i}",
+            "year": 1990 + i % 35,
+            "rating_key": 1000 + i,
+            "summary": "A long summary of the plot. " * 8,
+            "audience_rating": 8.1,
+            "content_rating": "PG-13",
+            "duration_minutes": 118,
+            "genres": ["Drama", "Thriller"],
+            "has_thumb": True,
+            "thumb_version": "1700000000",
+        }
+        for i in range(n)
+    ]
+
+
+def stdlib_dumps(data) -> bytes:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def row(name: str, fn, n: int) -> None:
+    body = fn()
+    body = body.body if hasattr(body, "body") else body
+    print(f"{name:<40} {per_call(fn, n):>9.1f} {len(body):>8} {len(gzip.compress(body, 6)):>8}")
+
+
+def main(n: int) -> None:
+    print(f"{'response':<40} {'us/call':>9} {'bytes':>8} {'gzip':>8}")
+    for count in (3, 10, 50):
+        picked = movies(count)
+        trimmed = [{f: m[f] for f in FIELDS} for m in picked]
+        cards = {"movies": picked, "server_machine_id": "abc123", "unreachable": []}
+        data = {"server_machine_id": "abc123", "movies": picked, "unreachable": []}
+        small = {**data, "movies": trimmed}
+        row(f"generate x{count}, html", lambda: render_fragment("partials/movie_cards.html", cards), n)
+        if orjson is not None:
+            row(f"generate x{count}, json (orjson)", lambda: json_fragment(data), n)
+            row(f"generate x{count}, json (orjson), fields", lambda: json_fragment(small), n)
+        row(f"generate x{count}, json (stdlib)", lambda: stdlib_dumps(data), n)
+        row(f"generate x{count}, json (stdlib), fields", lambda: stdlib_dumps(small), n)
+    row("filters, html", lambda: render_fragment("partials/filter_form.html", FILTERS), n)
+    row("filters, json", lambda: json_fragment(FILTERS), n)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    main(parser.parse_args().calls)
@@ -0,0 +1,306 @@
+"""Offline load test: the real app against fake Plex servers.
+
+Starts bench.fake_plex and the app (uvicorn, one worker) as subprocesses on
+free local ports. Each scenario is then driven at every `--concurrency`
+level, and the driver reports throughput, p50/p99 latency, errors, and the
+app's resident memory (current and peak).
+
+Scenarios:
+
+- filters: GET /api/filters
+- generate: POST /api/generate (count=3, random filter mix)
+- generate-json: the same, asking for JSON instead of the HTML cards
+- generate-playlist: POST /api/generate from a playlist
+- poster-card: cached, resized poster variant
+- poster-original: poster streamed through from Plex
+- stalled: /api/generate on a healthy server, measured once alone and once
+  while other users hammer a second server that never answers
+
+Results can be saved with `--json` and compared against an earlier run with
+`--compare`, so changes to plex_service and the routers can be checked for
+regressions.
+
+    python -m bench.load [--movies 20000] [--concurrency 1,8,32] [--requests 400]
+                         [--latency-ms 5] [--json out.json] [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from itsdangerous import URLSafeSerializer
+
+from bench.fake_plex import CONTENT_RATINGS, GENRES, movie
+
+SECRET = "bench-secret"
+TOKEN = "bench-token"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(args: list[str], log_path: str, env: dict | None = None) -> subprocess.Popen:
+    with open(log_path, "ab") as log:
+        return subprocess.Popen(
+            [sys.executable, *args], env={**os.environ, **(env or {})}, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+async def wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def rss_mb(pid: int) -> tuple[float, float]:
+    """Current and peak resident memory of `pid` in MiB (Linux /proc), or NaN elsewhere."""
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return float("nan"), float("nan")
+    fields = dict(line.split(":", 1) for line in status.splitlines() if ":" in line)
+    return (int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024)
+
+
+def session_cookie(server_url: str) -> str:
+    signer = URLSafeSerializer(SECRET, salt="session")
+    return signer.dumps({"plex_token": TOKEN, "server_url": server_url, "server_name": "Bench"})
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+async def drive(client: httpx.AsyncClient, make_request, total: int, concurrency: int) -> dict:
+    """Send `total` requests with `concurrency` in flight; return latency stats."""
+    latencies: list[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, path, kwargs = make_request()
+            started = time.perf_counter()
+            try:
+                resp = await client.request(method, path, **kwargs)
+                if resp.status_code >= 400 or resp.headers.get("HX-Redirect"):
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "mean_ms": statistics.fmean(latencies) * 1e3 if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+def scenarios(movies: int) -> dict:
+    def filters():
+        return "GET", "/api/filters", {}
+
+    def generate():
+        form = {"count": "3"}
+        roll = random.random()
+        if roll < 0.3:
+            form["genre"] = random.choice(GENRES)
+        elif roll < 0.5:
+            form["content_rating"] = random.choice(CONTENT_RATINGS)
+        elif roll < 0.6:
+            form["min_rating"] = "7"
+        return "POST", "/api/generate", {"data": form}
+
+    def generate_json():
+        method, path, kwargs = generate()
+        return method, path, {**kwargs, "headers": {"Accept": "application/json"}}
+
+    def generate_playlist():
+        return "POST", "/api/generate", {"data": {"count": "3", "playlist_key": str(random.randint(1, 5))}}
+
+    def poster_card():
+        m = movie(random.randrange(min(movies, 200)))
+        return "GET", f"/api/poster/{m['ratingKey']}?v={m['thumbVersion']}&size=card", {}
+
+    def poster_original():
+        return "GET", f"/api/poster/{movie(random.randrange(movies))['ratingKey']}", {}
+
+    return {
+        "filters": filters,
+        "generate": generate,
+        "generate-json": generate_json,
+        "generate-playlist": generate_playlist,
+        "poster-card": poster_card,
+        "poster-original": poster_original,
+    }
+
+
+async def run(args) -> list[dict]:
+    fake_port, stalled_port, app_port = free_port(), free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    stalled_url = f"http://127.0.0.1:{stalled_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    workdir = tempfile.mkdtemp(prefix="movienight-bench-")
+
+    fake_args = ["-m", "bench.fake_plex", "--movies", str(args.movies), "--latency-ms", str(args.latency_ms),
+                 "--fail-rate", str(args.fail_rate)]
+    log_path = f"{workdir}/server.log"
+    print(f"server logs: {log_path}")
+    procs = [
+        start([*fake_args, "--port", str(fake_port)], log_path),
+        start(["-m", "bench.fake_plex", "--port", str(stalled_port), "--stall"], log_path),
+    ]
+    app_proc = start(
+        ["-m", "uvicorn", "app.main:app", "--port", str(app_port), "--log-level", "warning"],
+        log_path,
+        env={
+            "SECRET_KEY": SECRET,
+            "SESSION_BACKEND": "cookie",
+            "CACHE_BACKEND": "memory",
+            "POSTER_CACHE_DIR": f"{workdir}/posters",
+            "TEMPLATE_CACHE_DIR": f"{workdir}/jinja",
+            "PLEX_CALL_TIMEOUT": str(args.stall_timeout),
+            "PLEX_TIMEOUT": str(args.stall_timeout),
+        },
+    )
+    procs.append(app_proc)
+
+    results = []
+    try:
+        await wait_ready(fake_url + "/identity")
+        await wait_ready(app_url + "/")
+        limits = httpx.Limits(max_connections=max(args.concurrency) * 3)
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=120) as client:
+            client.cookies.set("mn_session", session_cookie(fake_url))
+
+            # Warm up: builds the library index and the filter cache
+            started = time.perf_counter()
+            await client.post("/api/generate", data={"count": "3"})
+            await client.get("/api/filters")
+            print(f"warm-up (index build for {args.movies} movies): {time.perf_counter() - started:.2f}s")
+
+            print(f"\n{'scenario':<22} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} "
+                  f"{'rss MiB':>8} {'peak':>7}")
+            for name, make_request in scenarios(args.movies).items():
+                if args.only and name not in args.only:
+                    continue
+                for concurrency in args.concurrency:
+                    stats = await drive(client, make_request, args.requests, concurrency)
+                    rss, peak = rss_mb(app_proc.pid)
+                    results.append({"scenario": name, "concurrency": concurrency, **stats,
+                                    "rss_mib": rss, "peak_rss_mib": peak})
+                    report(results[-1])
+
+            if not args.only or "stalled" in args.only:
+                results.extend(await stalled(args, app_url, stalled_url, client, app_proc.pid))
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()  # uvicorn waits on open connections, and the stalled server never closes them
+                proc.wait()
+    return results
+
+
+async def stalled(args, app_url: str, stalled_url: str, healthy: httpx.AsyncClient, app_pid: int) -> list[dict]:
+    """p99 of /api/generate on a healthy server, alone and next to a stalled one."""
+    generate = scenarios(args.movies)["generate"]
+    concurrency = max(args.concurrency)
+    results = []
+
+    stats = await drive(healthy, generate, args.requests, concurrency)
+    results.append({"scenario": "stalled:baseline", "concurrency": concurrency, **stats,
+                    "rss_mib": rss_mb(app_pid)[0], "peak_rss_mib": rss_mb(app_pid)[1]})
+    report(results[-1])
+
+    # Other users keep retrying against a server that never answers
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.stall_timeout * 3,
+                                 limits=httpx.Limits(max_connections=args.stalled_clients * 2)) as stuck:
+        stuck.cookies.set("mn_session", session_cookie(stalled_url))
+        background = asyncio.create_task(drive(stuck, generate, 10**9, args.stalled_clients))
+        await asyncio.sleep(0.5)  # let the stalled calls pile up first
+        stats = await drive(healthy, generate, args.requests, concurrency)
+        background.cancel()
+        try:
+            await background
+        except asyncio.CancelledError:
+            pass
+    results.append({"scenario": "stalled:with-stall", "concurrency": concurrency, **stats,
+                    "rss_mib": rss_mb(app_pid)[0], "peak_rss_mib": rss_mb(app_pid)[1]})
+    report(results[-1])
+    return results
+
+
+def report(r: dict) -> None:
+    print(f"{r['scenario']:<22} {r['concurrency']:>5} {r['rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+          f"{r['errors']:>7} {r['rss_mib']:>8.1f} {r['peak_rss_mib']:>7.1f}")
+
+
+def compare(results: list[dict], baseline_path: str) -> None:
+    baseline = {(r["scenario"], r["concurrency"]): r for r in json.loads(Path(baseline_path).read_text())}
+    print(f"\n{'vs ' + baseline_path:<28} {'req/s':>9} {'p99':>9}")
+    for r in results:
+        old = baseline.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+        rps = (r["rps"] / old["rps"] - 1) * 100
+        p99 = (r["p99_ms"] / old["p99_ms"] - 1) * 100
+        print(f"{r['scenario'] + ' @' + str(r['concurrency']):<28} {rps:>+8.1f}% {p99:>+8.1f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--movies", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario and concurrency level")
+    parser.add_argument("--latency-ms", type=float, default=5, help="latency added to each fake Plex response")
+    parser.add_argument("--fail-rate", type=float, default=0, help="fraction of fake Plex responses that are 500s")
+    parser.add_argument("--stall-timeout", type=int, default=5, help="PLEX_CALL_TIMEOUT for the app under test")
+    parser.add_argument("--stalled-clients", type=int, default=16)
+    parser.add_argument("--only", type=lambda s: s.split(","), help="comma-separated scenario names")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="print changes against results saved with --json")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Microbenchmark: per-request overhead of the session middleware.
+
+Compares a bare app, the previous BaseHTTPMiddleware implementation
+(reproduced below as the baseline), and app.session_store.SessionMiddleware.
+It measures a page that reads the session and a static-file-style path,
+with and without a session cookie. Everything is driven in-process through
+raw ASGI calls, so only middleware cost is measured.
+
+    python -m bench.session_overhead [--requests 20000]
+"""
+
+import argparse
+import asyncio
+import time
+
+from itsdangerous import URLSafeSerializer
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from app.config import settings
+from app.session_store import COOKIE_NAME, MAX_AGE, SessionMiddleware
+
+_signer = URLSafeSerializer(settings.secret_key, salt="session")
+_PERSIST_KEYS = {"plex_token", "server_url", "server_name", "pin_id", "pin_code"}
+
+
+class LegacySessionMiddleware(BaseHTTPMiddleware):
+    """The BaseHTTPMiddleware session layer this repo used before."""
+
+    async def dispatch(self, request, call_next):
+        raw = request.cookies.get(COOKIE_NAME)
+        session = {}
+        if raw:
+            try:
+                session = _signer.loads(raw)
+            except Exception:
+                session = {}
+        request.state.session = session
+        response = await call_next(request)
+        to_persist = {k: v for k, v in session.items() if k in _PERSIST_KEYS}
+        response.set_cookie(COOKIE_NAME, _signer.dumps(to_persist), max_age=MAX_AGE, httponly=True, samesite="lax")
+        return response
+
+
+async def page(request: Request):
+    session = getattr(request.state, "session", {})
+    return PlainTextResponse(session.get("server_name", "none"))
+
+
+async def static(request: Request):
+    return PlainTextResponse("body { }")
+
+
+def build(middleware=None) -> Starlette:
+    app = Starlette(routes=[Route("/generate", page), Route("/static/app.css", static)])
+    if middleware is not None:
+        app.add_middleware(middleware)
+    return app
+
+
+async def drive(app, path: str, cookie: str | None, n: int) -> float:
+    headers = [(b"host", b"bench")]
+    if cookie:
+        headers.append((b"cookie", f"{COOKIE_NAME}={cookie}".encode()))
+    scope_base = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "server": ("bench", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    # Warm up routing and caches before timing
+    for _ in range(200):
+        await app(dict(scope_base), receive, send)
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope_base), receive, send)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+async def main(n: int) -> None:
+    cookie = _signer.dumps({"plex_token": "x" * 20, "server_url": "https://plex.example.com", "server_name": "Home"})
+    variants = [
+        ("no middleware", build()),
+        ("BaseHTTPMiddleware (before)", build(LegacySessionMiddleware)),
+        ("pure ASGI (after)", build(SessionMiddleware)),
+    ]
+    cases = [("/generate", cookie), ("/generate", None), ("/static/app.css", cookie)]
+    print(f"{'variant':<30} {'path':<18} {'cookie':<7} {'us/req':>8}")
+    for name, app in variants:
+        for path, ck in cases:
+            us = await drive(app, path, ck, n)
+            print(f"{name:<30} {path:<18} {'yes' if ck else 'no':<7} {us:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    asyncio.run(main(parser.parse_args().requests))
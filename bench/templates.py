@@ -0,0 +1,111 @@
+"""Microbenchmark: template startup, fragment render and compression cost.
+
+Startup compares loading every template with a cold bytecode cache, a
+warm one, and none at all (what each router's own Jinja2Templates did
+before). Fragment timings compare a fresh filter_form render with a
+memoized one, and show what a movie_cards render costs. The compression
+table lists body size and encode time for gzip and (if installed) brotli.
+
+    python -m bench.templates [--renders 2000]
+"""
+
+import argparse
+import gzip
+import tempfile
+import time
+
+import jinja2
+
+from app.config import settings
+from app.templating import brotli, memoized_fragment, render_fragment
+
+TEMPLATES = [
+    "base.html",
+    "index.html",
+    "generate.html",
+    "login_waiting.html",
+    "partials/filter_form.html",
+    "partials/movie_cards.html",
+    "partials/nav.html",
+    "partials/server_select.html",
+]
+
+FILTERS = {
+    "genres": [f"Genre {i}" for i in range(30)],
+    "content_ratings": ["G", "PG", "PG-13", "R", "NC-17", "NR"],
+    "decades": [str(d) for d in range(1920, 2030, 10)],
+    "playlists": [{"ratingKey": str(i), "title": f"Playlist {i}"} for i in range(10)],
+    "libraries": [{"key": "1", "title": "Movies"}, {"key": "2", "title": "Kids"}],
+}
+
+MOVIES = [
+    {
+        "rating_key": 1000 + i,
+        "title": f"Movie {i}",
+        "year": 1990 + i,
+        "summary": "A long summary of the plot. " * 8,
+        "rating": 7.5,
+        "audience_rating": 8.1,
+        "content_rating": "PG-13",
+        "duration_minutes": 118,
+        "genres": ["Drama", "Thriller"],
+        "has_thumb": True,
+        "thumb_version": "1700000000",
+    }
+    for i in range(3)
+]
+
+
+def load_all(bytecode_dir: str | None) -> float:
+    start = time.perf_counter()
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader("app/templates"),
+        autoescape=True,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_dir) if bytecode_dir else None,
+    )
+    for name in TEMPLATES:
+        env.get_template(name)
+    return (time.perf_counter() - start) * 1e3
+
+
+def per_call(fn, n: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main(n: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        no_cache = load_all(None)
+        cold = load_all(tmp)
+        warm = load_all(tmp)
+    print(f"{'startup (load all templates)':<36} {'ms':>8}")
+    print(f"{'no bytecode cache':<36} {no_cache:>8.2f}")
+    print(f"{'bytecode cache, cold':<36} {cold:>8.2f}")
+    print(f"{'bytecode cache, warm':<36} {warm:>8.2f}")
+
+    cards = {"movies": MOVIES, "server_machine_id": "abc123"}
+    print(f"\n{'fragment':<36} {'us/call':>8}")
+    print(f"{'filter_form, fresh render':<36} {per_call(lambda: render_fragment('partials/filter_form.html', FILTERS), n):>8.1f}")
+    print(f"{'filter_form, memoized':<36} {per_call(lambda: memoized_fragment('partials/filter_form.html', FILTERS), n):>8.1f}")
+    print(f"{'movie_cards (3 movies)':<36} {per_call(lambda: render_fragment('partials/movie_cards.html', cards), n):>8.1f}")
+
+    print(f"\n{'compression':<36} {'bytes':>8} {'us/call':>8}")
+    for name, ctx in (("filter_form", FILTERS), ("movie_cards", cards)):
+        body = render_fragment(f"partials/{name}.html", ctx).body
+        print(f"{name + ', identity':<36} {len(body):>8}")
+        level = settings.compress_level_gzip
+        print(f"{name + ', gzip':<36} {len(gzip.compress(body, level)):>8} "
+              f"{per_call(lambda: gzip.compress(body, level), n // 4):>8.1f}")
+        if brotli is not None:
+            quality = settings.compress_level_br
+            print(f"{name + ', br':<36} {len(brotli.compress(body, quality=quality)):>8} "
+                  f"{per_call(lambda: brotli.compress(body, quality=quality), n // 4):>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--renders", type=int, default=2000)
+    main(parser.parse_args().renders)